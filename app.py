@@ -1,347 +1,464 @@
 import streamlit as st
-import pandas as pd
-import re
-from datetime import datetime
-import io
-# import requests # Descomente se for usar para enviar dados via HTTP POST
+import logging
+import math
+import os
+import tempfile
+from datetime import date
+from cnis.cache import ResultCache, make_cache_key
+from cnis.storage import UploadStore, content_digest
+from cnis.records import RecordStore
+from cnis.inss import INSS_TABLES_VERSION
+from cnis.analysis import combine_results
+from cnis.export import EXPORT_MIME_TYPES, breakdown_export_bytes, xlsx_available
+from cnis.metrics import PERCENTILES, REGISTRY
+from cnis.outbox import LeadOutbox, lead_idempotency_key
+from cnis.scheduler import (DEFAULT_JOB_TIMEOUT, DEFAULT_MAX_BYTES, DEFAULT_MAX_PAGES, DEFAULT_MAX_QUEUE,
+                            AnalysisScheduler)
+
+logger = logging.getLogger("cnis.app")
 
 # ----------------------------------------------------------------------
-# TABELAS INSS - Alíquotas e Tetos por período
+# CACHE DE RESULTADOS
 # ----------------------------------------------------------------------
-INSS_TABLES = {
-    "2025-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1518.00, "aliquot": 0.075},
-            {"min": 1518.01, "max": 2793.88, "aliquot": 0.09},
-            {"min": 2793.89, "max": 4190.83, "aliquot": 0.12},
-            {"min": 4190.84, "max": 8157.41, "aliquot": 0.14}
-        ],
-        "ceiling": 8157.41
-    },
-    "2024-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1412.00, "aliquot": 0.075},
-            {"min": 1412.01, "max": 2666.68, "aliquot": 0.09},
-            {"min": 2666.69, "max": 4000.03, "aliquot": 0.12},
-            {"min": 4000.04, "max": 7786.02, "aliquot": 0.14}
-        ],
-        "ceiling": 7786.02
-    },
-    "2023-05": {
-        "ranges": [
-            {"min": 0.00, "max": 1320.00, "aliquot": 0.075},
-            {"min": 1320.01, "max": 2571.29, "aliquot": 0.09},
-            {"min": 2571.30, "max": 3856.94, "aliquot": 0.12},
-            {"min": 3856.95, "max": 7507.49, "aliquot": 0.14}
-        ],
-        "ceiling": 7507.49
-    },
-    "2023-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1302.00, "aliquot": 0.075},
-            {"min": 1302.01, "max": 2571.29, "aliquot": 0.09},
-            {"min": 2571.30, "max": 3856.94, "aliquot": 0.12},
-            {"min": 3856.95, "max": 7507.49, "aliquot": 0.14}
-        ],
-        "ceiling": 7507.49
-    },
-    "2022-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1212.00, "aliquot": 0.075},
-            {"min": 1212.01, "max": 2427.35, "aliquot": 0.09},
-            {"min": 2427.36, "max": 3641.03, "aliquot": 0.12},
-            {"min": 3641.04, "max": 7087.22, "aliquot": 0.14}
-        ],
-        "ceiling": 7087.22
-    },
-    "2021-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1100.00, "aliquot": 0.075},
-            {"min": 1100.01, "max": 2203.48, "aliquot": 0.09},
-            {"min": 2203.49, "max": 3305.22, "aliquot": 0.12},
-            {"min": 3305.23, "max": 6433.57, "aliquot": 0.14}
-        ],
-        "ceiling": 6433.57
-    },
-    "2020-03": {
-        "ranges": [
-            {"min": 0.00, "max": 1045.00, "aliquot": 0.075},
-            {"min": 1045.01, "max": 2089.60, "aliquot": 0.09},
-            {"min": 2089.61, "max": 3134.40, "aliquot": 0.12},
-            {"min": 3134.41, "max": 6101.06, "aliquot": 0.14}
-        ],
-        "ceiling": 6101.06
-    },
-    "2020-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1830.29, "aliquot": 0.08},
-            {"min": 1830.30, "max": 3050.52, "aliquot": 0.09},
-            {"min": 3050.53, "max": 6101.06, "aliquot": 0.11}
-        ],
-        "ceiling": 6101.06
-    },
-    "2019-01": {
-        "ranges": [
-            {"min": 0.00, "max": 1751.81, "aliquot": 0.08},
-            {"min": 1751.82, "max": 2919.72, "aliquot": 0.09},
-            {"min": 2919.73, "max": 5839.45, "aliquot": 0.11}
-        ],
-        "ceiling": 5839.45
-    }
-}
-
-def calculate_inss(salary, competence_dt):
-    comp_year = competence_dt.year
-    comp_month = competence_dt.month
-
-    table_key = None
-    # Itera sobre as chaves da tabela em ordem decrescente para encontrar a tabela correta
-    for key in sorted(INSS_TABLES.keys(), reverse=True):
-        table_year = int(key.split("-")[0])
-        table_month = int(key.split("-")[1])
-        
-        # Se o ano da competência for maior que o ano da tabela, ou
-        # se o ano for o mesmo e o mês da competência for maior ou igual ao mês da tabela,
-        # então esta é a tabela mais recente aplicável.
-        if comp_year > table_year or (comp_year == table_year and comp_month >= table_month):
-            table_key = key
-            break
-    
-    if not table_key:
-        # Se nenhuma tabela for encontrada (ex: data muito antiga), retorna 0
-        return 0.0
-
-    table = INSS_TABLES[table_key]
-    contribution = 0.0
-    
-    # Aplica o teto do INSS antes de calcular a contribuição
-    salary_for_calculation = min(salary, table["ceiling"])
-
-    remaining_salary = salary_for_calculation
-    
-    # Calcula a contribuição progressiva
-    for r in table["ranges"]:
-        if remaining_salary <= 0:
-            break
-        
-        # Calcula a porção do salário que cai nesta faixa
-        # A porção é o mínimo entre o salário restante e a largura da faixa
-        # (r["max"] - r["min"] + 0.01 para incluir o limite superior da faixa)
-        # Ou, se o salário for menor que o limite superior da faixa, a porção é o que resta do salário
-        
-        # Ajuste para cálculo progressivo correto:
-        # A contribuição é calculada sobre a parte do salário que se encaixa em cada faixa.
-        # O valor a ser considerado para a faixa é o mínimo entre o salário restante
-        # e o valor máximo da faixa menos o valor mínimo da faixa (mais 0.01 para cobrir o limite superior).
-        
-        # Exemplo: Salário 2000, Faixa 1 (0-1412, 7.5%), Faixa 2 (1412.01-2666.68, 9%)
-        # Na Faixa 1: contribui sobre 1412 * 0.075
-        # Na Faixa 2: contribui sobre (2000 - 1412) * 0.09
-        
-        # Valor efetivo dentro da faixa atual
-        portion_in_range = min(remaining_salary, r["max"] - r["min"] + 0.01) # +0.01 para incluir o limite superior
-        
-        # Garante que a porção não seja negativa
-        if portion_in_range < 0:
-            portion_in_range = 0
-            
-        contribution += portion_in_range * r["aliquot"]
-        remaining_salary -= portion_in_range
-
-    # O cálculo progressivo já lida com o teto implicitamente ao limitar salary_for_calculation
-    # e ao iterar pelas faixas. O max_contribution abaixo é mais para verificar o teto teórico
-    # se o salário fosse exatamente o teto, mas o cálculo progressivo já é o método correto.
-    # A linha `return min(contribution, max_contribution)` do código original não é necessária
-    # se o `salary_for_calculation` já limita o salário ao teto antes do cálculo progressivo.
-    # No entanto, para manter a lógica original de "teto de contribuição", podemos recalcular
-    # a contribuição máxima sobre o teto.
-    
-    # Recalcula a contribuição máxima possível sobre o teto para garantir que não exceda
-    max_contribution_at_ceiling = 0.0
-    ceiling_remaining = table["ceiling"]
-    for r in table["ranges"]:
-        if ceiling_remaining <= 0:
-            break
-        
-        # Porção da faixa que está abaixo ou igual ao teto
-        portion_of_ceiling_in_range = min(ceiling_remaining, r["max"] - r["min"] + 0.01)
-        if portion_of_ceiling_in_range < 0:
-            portion_of_ceiling_in_range = 0
-            
-        max_contribution_at_ceiling += portion_of_ceiling_in_range * r["aliquot"]
-        ceiling_remaining -= portion_of_ceiling_in_range
-
-    return min(contribution, max_contribution_at_ceiling)
-
-
-def get_inss_ceiling(competence_dt):
-    comp_year = competence_dt.year
-    comp_month = competence_dt.month
-
-    table_key = None
-    for key in sorted(INSS_TABLES.keys(), reverse=True):
-        table_year = int(key.split("-")[0])
-        table_month = int(key.split("-")[1])
-        if comp_year > table_year or (comp_year == table_year and comp_month >= table_month):
-            table_key = key
-            break
-    
-    if not table_key:
-        return 0.0
-    
-    return INSS_TABLES[table_key]["ceiling"]
+@st.cache_resource
+def get_result_cache():
+    # Instância única por processo, compartilhada entre reruns e sessões.
+    # Defina CNIS_CACHE_DIR para habilitar o nível em disco (sobrevive a reinícios do app).
+    return ResultCache(
+        max_entries=int(os.environ.get("CNIS_CACHE_MAX_ENTRIES", "128")),
+        ttl_seconds=int(os.environ.get("CNIS_CACHE_TTL_SECONDS", "3600")),
+        disk_dir=os.environ.get("CNIS_CACHE_DIR") or None,
+        disk_max_bytes=int(os.environ.get("CNIS_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024))),
+    )
 
 # ----------------------------------------------------------------------
-# FUNÇÃO PRINCIPAL DE ANÁLISE DO CNIS
+# ARMAZENAMENTO DOS PDFs ENVIADOS
 # ----------------------------------------------------------------------
-def analyze_cnis_pdf(pdf_file):
-    try:
-        # Importa fitz (PyMuPDF) aqui para garantir que a importação ocorra apenas se a função for chamada
-        # e para que o erro seja mais específico se PyMuPDF não estiver instalado.
-        import fitz 
-        # Usar io.BytesIO para garantir que o arquivo seja lido como bytes
-        doc = fitz.open(stream=io.BytesIO(pdf_file.read()), filetype="pdf")
-        texto = "".join(page.get_text() for page in doc)
-        doc.close()
-    except ImportError:
-        st.error("Erro: A biblioteca 'PyMuPDF' (fitz) não está instalada. Por favor, adicione 'PyMuPDF' ao seu requirements.txt.")
-        return None
-    except Exception as e:
-        st.error(f"Erro ao extrair texto do PDF. Certifique-se de que é um PDF válido e não está protegido. Erro: {e}")
-        return None
-
-    CNPJ_RE        = r"\d{2}\.\d{3}\.\d{3}(?:/\d{4}-\d{2})?"
-    re_cnpj_bloco  = re.compile(CNPJ_RE)
-    re_simples     = re.compile(r"^(\d{2}/\d{4})\s+([\d.,]+)$", re.MULTILINE)
-    re_agrup       = re.compile(
-        rf"""
-          ^(\d{{2}}/\d{{4}})            # 1 - Competência
-          \s+({CNPJ_RE})                # 2 - CNPJ 1 (coluna Contrat.)
-          (?:\s+({CNPJ_RE}))?           # 3 - CNPJ 2 (opcional)
-          \s+.*?                        # lixo
-          \s+([\d.,]+)$                 # 4 - Valor
-        """,
-        re.MULTILINE | re.VERBOSE,
+@st.cache_resource
+def get_upload_store():
+    # PDFs guardados para o lead ficam em disco, deduplicados pelo hash do conteúdo;
+    # a sessão guarda só a chave (ver cnis/storage.py).
+    return UploadStore(
+        os.environ.get("CNIS_UPLOAD_DIR") or os.path.join(tempfile.gettempdir(), "cnis-uploads"),
+        max_bytes=int(os.environ.get("CNIS_UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024))),
+        ttl_seconds=int(os.environ.get("CNIS_UPLOAD_TTL_SECONDS", str(7 * 24 * 3600))),
+    )
+
+
+@st.cache_resource
+def get_record_store():
+    # Registros extraídos de cada extrato, em Parquet, para reanálises e cenários sem
+    # reabrir os PDFs (ver cnis/records.py). Desligado se CNIS_RECORDS_DIR não estiver definido.
+    directory = os.environ.get("CNIS_RECORDS_DIR")
+    return RecordStore(directory) if directory else None
+
+
+def upload_digest(pdf_file):
+    # SHA-256 do upload, calculado uma única vez por arquivo e sessão (os reruns
+    # recriam o UploadedFile, mas o file_id se mantém). getvalue() devolve o buffer
+    # do próprio upload, sem cópia.
+    digests = st.session_state.setdefault("uploaded_pdf_digests", {})
+    digest = digests.get(pdf_file.file_id)
+    if digest is None:
+        digest = digests[pdf_file.file_id] = content_digest(pdf_file.getvalue())
+    return digest
+
+# ----------------------------------------------------------------------
+# FILA DE ENVIO DOS LEADS
+# ----------------------------------------------------------------------
+@st.cache_resource
+def get_lead_outbox():
+    # Fila durável (SQLite) drenada por uma thread em segundo plano. Sem
+    # CNIS_LEAD_WEBHOOK_URL, os leads ficam guardados na fila até o webhook ser configurado.
+    # CNIS_LEAD_ATTACH_PDF=1 envia o PDF (em base64) junto com o lead; sem ele, só a referência.
+    outbox = LeadOutbox(
+        os.environ.get("CNIS_OUTBOX_DB") or os.path.join(tempfile.gettempdir(), "cnis-outbox.sqlite3"),
+        webhook_url=os.environ.get("CNIS_LEAD_WEBHOOK_URL") or None,
+        upload_store=get_upload_store(),
+        attach_pdf=os.environ.get("CNIS_LEAD_ATTACH_PDF", "").lower() in ("1", "true", "yes"),
+    )
+    return outbox.start()
+
+# ----------------------------------------------------------------------
+# FILA DE ANÁLISES
+# ----------------------------------------------------------------------
+@st.cache_resource
+def get_analysis_scheduler():
+    # Fila única do processo: limita as análises simultâneas de todas as sessões, recusa
+    # PDFs grandes demais antes de analisá-los e dá um prazo a cada análise
+    # (ver cnis/scheduler.py).
+    scheduler = AnalysisScheduler(
+        max_concurrent=int(os.environ.get("CNIS_MAX_CONCURRENT", "0")) or None,
+        max_queue=int(os.environ.get("CNIS_MAX_QUEUE", str(DEFAULT_MAX_QUEUE))),
+        max_bytes=int(os.environ.get("CNIS_MAX_PDF_BYTES", str(DEFAULT_MAX_BYTES))),
+        max_pages=int(os.environ.get("CNIS_MAX_PDF_PAGES", str(DEFAULT_MAX_PAGES))),
+        job_timeout=float(os.environ.get("CNIS_ANALYSIS_TIMEOUT", str(DEFAULT_JOB_TIMEOUT))),
     )
+    return scheduler.start()
+
+# Intervalo de atualização da posição na fila, em segundos
+QUEUE_POLL_SECONDS = 0.5
+
+
+def submit_analysis(pdf_file, today, cache_key):
+    # Um pedido por extrato e sessão, guardado na session_state: um rerun durante a
+    # espera volta a aguardar o mesmo pedido, em vez de entrar de novo na fila.
+    tickets = st.session_state.setdefault("analysis_tickets", {})
+    digest = upload_digest(pdf_file)
+    ticket = tickets.get(digest)
+    if ticket is None or ticket.key != cache_key:
+        ticket = tickets[digest] = get_analysis_scheduler().submit(
+            cache_key, pdf_file.getvalue(), today=today, record_store=get_record_store(), record_key=digest)
+    return ticket
+
+
+def ticket_result(pdf_file, ticket):
+    # Um pedido recusado com a fila cheia não fica guardado: o próximo rerun tenta de
+    # novo. Os demais, inclusive os recusados pelo tamanho do PDF, ficam (o mesmo
+    # arquivo seria recusado outra vez).
+    result = ticket.result()
+    if ticket.queue_full:
+        st.session_state["analysis_tickets"].pop(upload_digest(pdf_file), None)
+    return result
+
+
+def release_tickets(pdf_files):
+    # Desiste dos pedidos de arquivos que saíram do upload (se ainda estiverem na fila)
+    digests = {upload_digest(pdf_file) for pdf_file in pdf_files}
+    tickets = st.session_state.get("analysis_tickets", {})
+    for digest in [digest for digest in tickets if digest not in digests]:
+        tickets.pop(digest).cancel()
 
-    dados = []
-    # O split por "Código Emp." pode ser problemático se essa string não for consistente.
-    # Uma abordagem mais robusta seria procurar por padrões de "Competência" e "Valor"
-    # em todo o texto, e então tentar associar ao CNPJ mais próximo.
-    # Por enquanto, mantemos o split original.
-    for bloco in re.split(r"Código Emp\.", texto):
-        bloco = bloco.strip()
-
-        if "AGRUPAMENTO DE CONTRATANTES/COOPERATIVAS" in bloco:
-            for comp, cnpj1, cnpj2, val in re_agrup.findall(bloco):
-                cnpj = cnpj1 # Assume cnpj1 é o principal
-                try:
-                    dados.append(
-                        {"Competência": comp,
-                         "CNPJ": cnpj,
-                         "Salário": float(val.replace(".", "").replace(",", "."))})
-                except ValueError:
-                    st.warning(f"Não foi possível converter o salário '{val}' para número na competência {comp} (agrupamento). Ignorando registro.")
+
+def queue_status(name, ticket):
+    position = ticket.position()
+    if not position:
+        return f"Analisando {name}..."
+    eta = ticket.eta()
+    wait = f", cerca de {math.ceil(eta)} s" if eta is not None else ""
+    return f"{name}: aguardando na fila de análise (posição {position}{wait})..."
+
+# Painel de diagnóstico de desempenho, desligado por padrão (CNIS_DEBUG_PANEL=1)
+DEBUG_PANEL = os.environ.get("CNIS_DEBUG_PANEL", "").lower() in ("1", "true", "yes")
+
+# ----------------------------------------------------------------------
+# RESULTADO FIXADO NA SESSÃO
+# ----------------------------------------------------------------------
+# A análise roda uma vez por conjunto de arquivos enviados, e os resultados ficam
+# fixados na session_state. Os reruns seguintes sem troca de arquivos (interação com
+# a página) só os exibem de novo, sem consultar o cache nem a fila de análises. O
+# resultado e o formulário de contato são fragmentos (st.fragment): interagir com
+# eles reexecuta só o próprio fragmento, e não o script inteiro.
+def upload_signature(pdf_files):
+    # Identifica os arquivos enviados sem ler o conteúdo (cada novo upload tem outro
+    # file_id); o mês entra porque define a janela de 5 anos
+    return date.today().strftime("%Y-%m"), tuple(pdf_file.file_id for pdf_file in pdf_files)
+
+
+def pinned_results(pdf_files):
+    pinned = st.session_state.get("pinned_analysis")
+    if pinned is not None and pinned["upload"] == upload_signature(pdf_files):
+        return pinned["results"]
+    return None
+
+
+def pin_results(pdf_files, results):
+    # Só conjuntos analisados com sucesso ficam fixados. Falhas passam de novo pela
+    # análise, que devolve o mesmo pedido (ver submit_analysis) ou, se ele foi recusado
+    # com a fila cheia, tenta outra vez.
+    if all(result["success"] for result in results):
+        st.session_state["pinned_analysis"] = {"upload": upload_signature(pdf_files), "results": results}
+
+
+def pinned_combined(pdf_files, results):
+    # A soma de vários extratos também é feita uma única vez por conjunto fixado
+    pinned = st.session_state.get("pinned_analysis")
+    if pinned is None or pinned["upload"] != upload_signature(pdf_files):
+        return combine_results(results)
+    if "combined" not in pinned:
+        pinned["combined"] = combine_results(results)
+    return pinned["combined"]
+
+# ----------------------------------------------------------------------
+# FUNÇÃO PRINCIPAL DE ANÁLISE DO CNIS
+# ----------------------------------------------------------------------
+def analyze_cnis_pdf(pdf_file):
+    # O resultado depende só do conteúdo do PDF, das tabelas do INSS e do mês de
+    # referência da janela de 5 anos; repetições do mesmo extrato vêm do cache.
+    # As demais passam pela fila de análises do processo; enquanto o pedido aguarda a
+    # vez, a posição na fila e a espera estimada ficam visíveis.
+    pinned = pinned_results([pdf_file])
+    if pinned is not None:
+        show_diagnostics(pinned[0])
+        return pinned[0]
+
+    today = date.today()
+
+    cache = get_result_cache()
+    digest = upload_digest(pdf_file)
+    cache_key = make_cache_key(None, INSS_TABLES_VERSION, today.strftime("%Y-%m"), digest=digest)
+    result = cache.get(cache_key)
+    if result is None:
+        ticket = submit_analysis(pdf_file, today, cache_key)
+        status = st.empty()
+        while not ticket.wait(QUEUE_POLL_SECONDS):
+            status.info(queue_status(pdf_file.name, ticket))
+        status.empty()
+        result = ticket_result(pdf_file, ticket)
+        if result["success"]:
+            cache.put(cache_key, result)
+
+    pin_results([pdf_file], [result])
+    show_diagnostics(result)
+    return result
+
+
+def show_diagnostics(result):
+    for diagnostic in result["diagnostics"]:
+        if diagnostic["level"] == "error":
+            st.error(diagnostic["message"])
+        else:
+            st.warning(diagnostic["message"])
+
+
+def analyze_cnis_pdfs(pdf_files):
+    # Vários extratos de uma vez. Os que já estão no cache aparecem de imediato; os
+    # demais entram juntos na fila de análises (que os executa em paralelo, até o
+    # limite do processo), e o cartão de cada arquivo é exibido assim que a sua análise
+    # termina. Devolve os resultados na ordem dos arquivos.
+    pinned = pinned_results(pdf_files)
+    if pinned is not None:
+        for pdf_file, result in zip(pdf_files, pinned):
+            render_file_card(st.empty(), pdf_file.name, result)
+        return pinned
+
+    today = date.today()
+    cache = get_result_cache()
+    progress = st.progress(0.0)
+    slots = [st.empty() for _ in pdf_files]
+
+    results = [None] * len(pdf_files)
+    cache_keys = [None] * len(pdf_files)
+    pending = []
+    for i, pdf_file in enumerate(pdf_files):
+        digest = upload_digest(pdf_file)
+        cache_keys[i] = make_cache_key(None, INSS_TABLES_VERSION, today.strftime("%Y-%m"), digest=digest)
+        results[i] = cache.get(cache_keys[i])
+        if results[i] is None:
+            pending.append(i)
+            slots[i].info(f"Analisando {pdf_file.name}...")
         else:
-            m = re_cnpj_bloco.search(bloco)
-            if not m:
+            render_file_card(slots[i], pdf_file.name, results[i])
+
+    done = len(pdf_files) - len(pending)
+    progress.progress(done / len(pdf_files), text=f"{done} de {len(pdf_files)} extratos analisados")
+    tickets = {i: submit_analysis(pdf_files[i], today, cache_keys[i]) for i in pending}
+    while tickets:
+        for i, ticket in list(tickets.items()):
+            if not ticket.done():
+                slots[i].info(queue_status(pdf_files[i].name, ticket))
                 continue
-            cnpj_bloco = m.group(0)
-            for comp, val in re_simples.findall(bloco):
-                try:
-                    dados.append(
-                        {"Competência": comp,
-                         "CNPJ": cnpj_bloco,
-                         "Salário": float(val.replace(".", "").replace(",", "."))} # CORREÇÃO AQUI: .replace(",", ".")
-                    )
-                except ValueError:
-                    st.warning(f"Não foi possível converter o salário '{val}' para número na competência {comp} (simples). Ignorando registro.")
-
-    if not dados:
-        st.warning("Nenhuma remuneração válida encontrada no extrato CNIS. Verifique o formato do arquivo.")
-        return None
-
-    df = pd.DataFrame(dados)
-    
-    # Calcula a contribuição INSS para cada registro
-    # Usamos .apply para maior eficiência em DataFrames grandes
-    df["Comp_dt"] = pd.to_datetime("01/" + df["Competência"], format="%d/%m/%Y", errors='coerce')
-    
-    # Remove linhas onde a conversão de data falhou
-    df.dropna(subset=["Comp_dt"], inplace=True)
-
-    if df.empty:
-        st.warning("Nenhuma competência válida encontrada após a conversão de datas.")
-        return None
-
-    df["Contribuição"] = df.apply(lambda row: calculate_inss(row["Salário"], row["Comp_dt"]), axis=1)
-
-    contribuicoes_a_maior_por_competencia = {}
-
-    for competencia, grupo in df.groupby("Competência"):
-        total_contribuicao_competencia = grupo["Contribuição"].sum()
-        
-        # Pega a primeira data de competência do grupo (todas são iguais para a mesma competência)
-        competencia_dt = grupo["Comp_dt"].iloc[0] 
-        
-        # Calcula a contribuição máxima teórica para o teto daquele período
-        teto_inss_periodo = get_inss_ceiling(competencia_dt)
-        contribuicao_maxima_teto = calculate_inss(teto_inss_periodo, competencia_dt)
-        
-        contribuicao_a_maior = max(0, total_contribuicao_competencia - contribuicao_maxima_teto)
-        
-        contribuicoes_a_maior_por_competencia[competencia] = contribuicao_a_maior
-        
-    today         = pd.Timestamp.today().normalize()
-    # Analisa os últimos 5 anos completos até o mês atual
-    start_cutoff  = pd.Timestamp(year=today.year - 5, month=today.month, day=1)
-
-    # Filtra o DataFrame para incluir apenas as competências dentro do período de 5 anos
-    df_filtered = df[df["Comp_dt"] >= start_cutoff].copy() # Usar .copy() para evitar SettingWithCopyWarning
-
-    if df_filtered.empty:
-        st.warning("Nenhuma remuneração encontrada nos últimos 5 anos para análise.")
-        return {
-            "success": True,
-            "total_contribuicoes_a_maior": 0.0,
-            "total_registros": 0,
-            "total_competencias": 0,
-            "periodo_analisado": {
-                "inicio": "N/A",
-                "fim": "N/A"
-            }
-        }
-
-    total_registros = len(df_filtered) # Total de registros no período analisado
-    total_competencias = df_filtered["Competência"].nunique()
-    competencia_min = df_filtered["Competência"].min()
-    competencia_max = df_filtered["Competência"].max()
-
-    # Mapeia as contribuições a maior para o DataFrame filtrado
-    # Isso garante que o sum final seja apenas do período analisado
-    df_filtered["Contribuição a maior"] = df_filtered["Competência"].map(contribuicoes_a_maior_por_competencia)
-
-    # Soma apenas as contribuições a maior do período filtrado
-    total_contribuicoes_a_maior_final = df_filtered["Contribuição a maior"].sum()
-
-    return {
-        "success": True,
-        "total_contribuicoes_a_maior": total_contribuicoes_a_maior_final,
-        "total_registros": total_registros,
-        "total_competencias": total_competencias,
-        "periodo_analisado": {
-            "inicio": competencia_min,
-            "fim": competencia_max
-        }
-    }
+            del tickets[i]
+            result = results[i] = ticket_result(pdf_files[i], ticket)
+            if result["success"]:
+                cache.put(cache_keys[i], result)
+            render_file_card(slots[i], pdf_files[i].name, result)
+            done += 1
+            progress.progress(done / len(pdf_files), text=f"{done} de {len(pdf_files)} extratos analisados")
+        if tickets:
+            next(iter(tickets.values())).wait(QUEUE_POLL_SECONDS)
+    pin_results(pdf_files, results)
+    return results
+
+
+def render_file_card(slot, name, result):
+    with slot.container():
+        if result["success"]:
+            st.markdown(f"**{name}**: R$ {result['total_contribuicoes_a_maior']:.2f} "
+                        f"({result['total_registros']} registros, {result['total_competencias']} competências, "
+                        f"{result['periodo_analisado']['inicio']} a {result['periodo_analisado']['fim']})")
+        else:
+            st.markdown(f"**{name}**: não foi possível processar o extrato.")
+        show_diagnostics(result)
+
+@st.fragment
+def render_result(title, result):
+    st.markdown("<div class='result-box'>", unsafe_allow_html=True)
+    st.markdown(f"<h3>{title}</h3>", unsafe_allow_html=True)
+    st.markdown(f"<p>Valor estimado de recuperação:</p><p class='result-value'>R$ {result['total_contribuicoes_a_maior']:.2f}</p>", unsafe_allow_html=True)
+    st.write(f"Registros analisados: {result['total_registros']}")
+    st.write(f"Competências: {result['total_competencias']}")
+    st.write(f"Período: {result['periodo_analisado']['inicio']} a {result['periodo_analisado']['fim']}")
+    st.markdown("</div>", unsafe_allow_html=True)
+    render_breakdown_download(result)
+
+
+def render_breakdown_download(result):
+    # Detalhamento por competência e CNPJ, gerado só quando o botão é clicado (em uma
+    # thread à parte, sem rerun do script) a partir do resultado já calculado. Resultados
+    # gravados no cache antes do detalhamento existir não trazem a tabela.
+    frame = result.get("detalhamento")
+    if frame is None or frame.empty:
+        return
+    formats = ["csv", "xlsx"] if xlsx_available() else ["csv"]
+    for column, fmt in zip(st.columns(len(formats)), formats):
+        with column:
+            st.download_button(
+                f"Baixar detalhamento ({fmt.upper()})",
+                data=lambda fmt=fmt: breakdown_export_bytes(frame, fmt),
+                file_name=f"detalhamento-cnis.{fmt}",
+                mime=EXPORT_MIME_TYPES[fmt],
+                on_click="ignore",
+            )
 
 # ----------------------------------------------------------------------
-# INTERFACE STREAMLIT
+# PAINEL DE DIAGNÓSTICO
 # ----------------------------------------------------------------------
-st.set_page_config(layout="centered", page_title="Análise CNIS - Recuperação de INSS")
+def render_debug_panel():
+    # Percentis do tempo e da variação de memória de cada etapa nas últimas análises
+    # deste processo (todas as sessões), a última análise e as estatísticas do cache
+    # (ver cnis/metrics.py).
+    with st.expander("Diagnóstico de desempenho"):
+        totals = REGISTRY.totals()
+        st.write(f"Análises neste processo: {totals['analyses']} ({totals['failures']} com falha)")
+
+        rows = []
+        for name, row in REGISTRY.percentiles().items():
+            line = {"Etapa": name, "Amostras": row["count"]}
+            for p in PERCENTILES:
+                line[f"p{p} (ms)"] = round(row[f"p{p}"] * 1000, 1)
+            line["Máx. (ms)"] = round(row["max"] * 1000, 1)
+            rows.append(line)
+        if rows:
+            st.table(rows)
+
+        rows = []
+        for name, row in REGISTRY.percentiles(memory=True).items():
+            line = {"Etapa": name, "Amostras": row["count"]}
+            for p in PERCENTILES:
+                line[f"p{p} (MiB)"] = round(row[f"p{p}"] / 2**20, 1)
+            line["Máx. (MiB)"] = round(row["max"] / 2**20, 1)
+            rows.append(line)
+        if rows:
+            st.write("Variação da memória residente (RSS) por etapa:")
+            st.table(rows)
+
+        recent = REGISTRY.recent()
+        if recent:
+            last = recent[-1]
+            st.write(f"Última análise: {last['pages']} páginas extraídas ({last.get('pages_skipped', 0)} fora da janela), "
+                     f"{last['text_chars']} caracteres, {last['records']} registros, "
+                     f"{last['wall_seconds'] * 1000:.0f} ms ({last['cpu_seconds'] * 1000:.0f} ms de CPU)")
+
+        st.write("Cache de resultados:")
+        st.json(get_result_cache().stats())
+        st.write("PDFs armazenados:")
+        st.json(get_upload_store().stats())
+        st.write("Fila de envio dos leads:")
+        st.json(get_lead_outbox().stats())
+        st.write("Fila de análises:")
+        st.json(get_analysis_scheduler().stats())
 
-# Custom CSS para um design mais limpo e moderno
-st.markdown("""
+# ----------------------------------------------------------------------
+# FORMULÁRIO DE CONTATO
+# ----------------------------------------------------------------------
+# Chave do file_uploader na session_state (os PDFs enviados, lidos no envio do lead)
+UPLOADER_KEY = "uploaded_pdfs"
+
+
+def keep_analysis(analysis_result, pdf_files):
+    # Guarda o resultado (de um extrato ou a soma de vários) e a referência aos PDFs
+    # na session_state, para uso no envio do formulário. A sessão guarda só as chaves,
+    # e não cópias dos bytes.
+    st.session_state["analysis_result"] = analysis_result
+    st.session_state["uploaded_pdf_name"] = ", ".join(pdf_file.name for pdf_file in pdf_files)
+    st.session_state["uploaded_pdf_keys"] = [upload_digest(pdf_file) for pdf_file in pdf_files]
+
+
+def store_uploads(pdf_keys):
+    # O conteúdo dos PDFs só vai para o armazenamento em disco quando um lead é enviado
+    # (uma única vez por arquivo): análises sem lead não ocupam o disco. Os arquivos
+    # vêm do próprio uploader, que continua com eles enquanto o formulário é exibido.
+    for pdf_file in st.session_state.get(UPLOADER_KEY) or []:
+        pdf_key = upload_digest(pdf_file)
+        if pdf_key in pdf_keys:
+            get_upload_store().put(pdf_file.getvalue(), pdf_key)
+
+
+@st.fragment
+def render_contact_form():
+    # Fragmento: o envio do formulário reexecuta só este trecho, com o resultado e as
+    # chaves dos PDFs que keep_analysis deixou na session_state
+    st.markdown("<div class='contact-form-container'>", unsafe_allow_html=True)
+    st.subheader("Preencha seus dados para contato")
+
+    with st.form("contact_form"):
+        nome = st.text_input("Nome Completo", key="nome_completo")
+        email = st.text_input("E-mail", key="email_contato")
+        telefone = st.text_input("Telefone (com DDD)", key="telefone_contato")
+        cpf = st.text_input("CPF (opcional)", key="cpf_contato")
+
+        submitted = st.form_submit_button("Continuar Processo")
+
+        if submitted:
+            if not nome or not email or not telefone:
+                st.error("Por favor, preencha Nome, E-mail e Telefone.")
+            else:
+                analysis_result = st.session_state["analysis_result"]
+                pdf_keys = st.session_state["uploaded_pdf_keys"]
+                store_uploads(pdf_keys)
+                # Armazenar dados do lead na session_state
+                # Estes dados podem ser usados para enviar para um serviço externo
+                st.session_state["lead_data"] = {
+                    "nome": nome,
+                    "email": email,
+                    "telefone": telefone,
+                    "cpf": cpf,
+                    "analysis_result": analysis_result,
+                    "uploaded_pdf_name": st.session_state["uploaded_pdf_name"],
+                    # O conteúdo dos PDFs fica no armazenamento em disco, sob estas chaves
+                    "uploaded_pdf_keys": pdf_keys
+                }
+
+                # O lead vai para a fila de saída local (uma inserção no SQLite, sem rede);
+                # o envio ao CRM, com novas tentativas, acontece em segundo plano
+                # (ver cnis/outbox.py). Reenviar o mesmo formulário não duplica o lead.
+                payload = {
+                    "nome": nome,
+                    "email": email,
+                    "telefone": telefone,
+                    "cpf": cpf,
+                    "valor_recuperacao_estimado": analysis_result['total_contribuicoes_a_maior'],
+                    "periodo_analisado": f"{analysis_result['periodo_analisado']['inicio']} a {analysis_result['periodo_analisado']['fim']}",
+                    "nome_arquivo_cnis": st.session_state["uploaded_pdf_name"]
+                }
+                lead_key = get_lead_outbox().enqueue(
+                    payload,
+                    attachment_keys=pdf_keys,
+                    idempotency_key=lead_idempotency_key(email, telefone, *pdf_keys),
+                )
+                st.session_state["lead_data"]["lead_key"] = lead_key
+
+                # Mensagem de sucesso para o usuário
+                st.success("Dados enviados com sucesso! Entraremos em contato em breve.")
+                st.write("**Recuperação garantida:** Só cobramos após a conclusão da análise completa e realização do pedido junto à Receita.")
+
+                # O lead fica na fila até ser entregue (python -m cnis.outbox status)
+                logger.debug("Lead na fila de envio: %s (%d PDF(s))", lead_key[:12], len(pdf_keys))
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# ----------------------------------------------------------------------
+# INTERFACE STREAMLIT
+# ----------------------------------------------------------------------
+# A interface fica em main() e só roda quando o script é executado pelo Streamlit
+# (onde __name__ == "__main__"). Os processos do pool de extração (cnis/extract.py)
+# reimportam o script principal como "__mp_main__" e, assim, não executam a interface.
+def main():
+    st.set_page_config(layout="centered", page_title="Análise CNIS - Recuperação de INSS")
+
+    # Custom CSS para um design mais limpo e moderno
+    st.markdown("""
 <style>
     .stApp { 
         background-color: #f0f2f6; 
@@ -417,118 +534,61 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Título e Subtítulo
-st.markdown("<h1 class='header-title'>Descubra se você tem direito à recuperação de INSS</h1>", unsafe_allow_html=True)
-st.markdown("<p class='subheader-text'>Analise seu extrato CNIS gratuitamente e descubra valores pagos a maior que podem ser recuperados. Nossa análise preliminar é rápida e segura.</p>", unsafe_allow_html=True)
-
-# Seção de Upload
-st.header("Análise do Seu Extrato CNIS")
-st.write("Faça o upload do seu extrato e descubra em segundos se você tem valores a recuperar.")
-
-uploaded_file = st.file_uploader("Arraste seu extrato CNIS aqui ou clique para selecionar o arquivo", type=["pdf"])
-
-if uploaded_file is not None:
-    st.info("Analisando seu extrato... Isso pode levar alguns segundos.")
-    
-    # Chamar a função de análise
-    analysis_result = analyze_cnis_pdf(uploaded_file)
-    
-    if analysis_result and analysis_result["success"]:
-        # Armazena o resultado da análise e o conteúdo do PDF na session_state
-        # para que possam ser acessados após o envio do formulário.
-        st.session_state["analysis_result"] = analysis_result
-        st.session_state["uploaded_pdf_name"] = uploaded_file.name
-        # É crucial armazenar o conteúdo binário do PDF se você planeja enviá-lo.
-        # uploaded_file.getvalue() lê o conteúdo UMA VEZ. Se você precisar dele novamente,
-        # ele deve ser armazenado ou o uploader deve ser re-executado.
-        st.session_state["uploaded_pdf_content"] = uploaded_file.getvalue() 
-        
-        st.markdown("<div class='result-box'>", unsafe_allow_html=True)
-        st.markdown("<h3>✅ Análise Concluída!</h3>", unsafe_allow_html=True)
-        st.markdown(f"<p>Valor estimado de recuperação:</p><p class='result-value'>R$ {analysis_result['total_contribuicoes_a_maior']:.2f}</p>", unsafe_allow_html=True)
-        st.write(f"Registros analisados: {analysis_result['total_registros']}")
-        st.write(f"Competências: {analysis_result['total_competencias']}")
-        st.write(f"Período: {analysis_result['periodo_analisado']['inicio']} a {analysis_result['periodo_analisado']['fim']}")
-        st.markdown("</div>", unsafe_allow_html=True)
-        
-        st.success("Sua análise foi concluída! Para continuar e obter uma apuração precisa, preencha seus dados abaixo.")
-        
-        # Formulário de Contato
-        st.markdown("<div class='contact-form-container'>", unsafe_allow_html=True)
-        st.subheader("Preencha seus dados para contato")
-        
-        with st.form("contact_form"):
-            nome = st.text_input("Nome Completo", key="nome_completo")
-            email = st.text_input("E-mail", key="email_contato")
-            telefone = st.text_input("Telefone (com DDD)", key="telefone_contato")
-            cpf = st.text_input("CPF (opcional)", key="cpf_contato")
-            
-            submitted = st.form_submit_button("Continuar Processo")
-            
-            if submitted:
-                if not nome or not email or not telefone:
-                    st.error("Por favor, preencha Nome, E-mail e Telefone.")
-                else:
-                    # Armazenar dados do lead na session_state
-                    # Estes dados podem ser usados para enviar para um serviço externo
-                    st.session_state["lead_data"] = {
-                        "nome": nome,
-                        "email": email,
-                        "telefone": telefone,
-                        "cpf": cpf,
-                        "analysis_result": st.session_state["analysis_result"],
-                        "uploaded_pdf_name": st.session_state["uploaded_pdf_name"]
-                        # O conteúdo binário do PDF está em st.session_state["uploaded_pdf_content"]
-                    }
-                    
-                    # --- LÓGICA DE ENVIO DE DADOS (EXEMPLO) ---
-                    # Aqui você integraria o envio de e-mail real ou para um serviço de webhook.
-                    # Para um protótipo simples, você pode apenas imprimir no console do Streamlit Cloud
-                    # ou usar um serviço como Formspree/Web3Forms.
-                    
-                    # Exemplo de como você enviaria para um webhook (requer 'requests' no requirements.txt)
-                    # import requests
-                    # try:
-                    #     webhook_url = "SUA_URL_DO_WEBHOOK_AQUI" # Ex: https://formspree.io/f/your_form_id
-                    #     payload = {
-                    #         "nome": nome,
-                    #         "email": email,
-                    #         "telefone": telefone,
-                    #         "cpf": cpf,
-                    #         "valor_recuperacao_estimado": analysis_result['total_contribuicoes_a_maior'],
-                    #         "periodo_analisado": f"{analysis_result['periodo_analisado']['inicio']} a {analysis_result['periodo_analisado']['fim']}",
-                    #         "nome_arquivo_cnis": st.session_state["uploaded_pdf_name"]
-                    #         # Para enviar o PDF, você precisaria codificá-lo em base64 ou fazer upload para um serviço de armazenamento
-                    #         # e enviar o link. Webhooks geralmente têm limites de tamanho para dados.
-                    #         # "cnis_pdf_base64": base64.b64encode(st.session_state["uploaded_pdf_content"]).decode('utf-8')
-                    #     }
-                    #     response = requests.post(webhook_url, json=payload)
-                    #     if response.status_code == 200:
-                    #         st.success("Dados enviados com sucesso! Entraremos em contato em breve.")
-                    #     else:
-                    #         st.error(f"Erro ao enviar dados. Código: {response.status_code}. Resposta: {response.text}")
-                    #         st.warning("Por favor, entre em contato conosco diretamente se o problema persistir.")
-                    # except Exception as e:
-                    #     st.error(f"Ocorreu um erro inesperado ao enviar os dados: {e}")
-                    #     st.warning("Por favor, entre em contato conosco diretamente se o problema persistir.")
-
-                    # Mensagem de sucesso para o usuário
-                    st.success("Dados enviados com sucesso! Entraremos em contato em breve.")
-                    st.write("**Recuperação garantida:** Só cobramos após a conclusão da análise completa e realização do pedido junto à Receita.")
-                    
-                    # Para depuração, você pode imprimir os dados no console do Streamlit Cloud
-                    print("\n--- DADOS DO LEAD CAPTURADOS ---")
-                    print(f"Nome: {nome}")
-                    print(f"Email: {email}")
-                    print(f"Telefone: {telefone}")
-                    print(f"CPF: {cpf if cpf else 'Não informado'}")
-                    print(f"Valor Estimado de Recuperação: R$ {analysis_result['total_contribuicoes_a_maior']:.2f}")
-                    print(f"Nome do Arquivo CNIS: {st.session_state['uploaded_pdf_name']}")
-                    print(f"Tamanho do Conteúdo do PDF: {len(st.session_state['uploaded_pdf_content'])} bytes")
-                    print("----------------------------------\n")
-
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    else:
-        st.error("Não foi possível processar o extrato CNIS. Por favor, tente novamente com um arquivo válido ou verifique o formato.")
+    # Título e Subtítulo
+    st.markdown("<h1 class='header-title'>Descubra se você tem direito à recuperação de INSS</h1>", unsafe_allow_html=True)
+    st.markdown("<p class='subheader-text'>Analise seu extrato CNIS gratuitamente e descubra valores pagos a maior que podem ser recuperados. Nossa análise preliminar é rápida e segura.</p>", unsafe_allow_html=True)
+
+    # Seção de Upload
+    st.header("Análise do Seu Extrato CNIS")
+    st.write("Faça o upload do seu extrato e descubra em segundos se você tem valores a recuperar.")
+
+    # Vários extratos podem ser enviados juntos (períodos separados, membros da família)
+    uploaded_files = st.file_uploader("Arraste seus extratos CNIS aqui ou clique para selecionar os arquivos", type=["pdf"], accept_multiple_files=True, key=UPLOADER_KEY)
+    release_tickets(uploaded_files)
+
+    if len(uploaded_files) == 1:
+        uploaded_file = uploaded_files[0]
+        if pinned_results(uploaded_files) is None:
+            st.info("Analisando seu extrato... Isso pode levar alguns segundos.")
+
+        # Chamar a função de análise
+        analysis_result = analyze_cnis_pdf(uploaded_file)
+
+        if analysis_result and analysis_result["success"]:
+            # Armazena o resultado da análise e a referência ao PDF na session_state
+            # para que possam ser acessados após o envio do formulário.
+            keep_analysis(analysis_result, [uploaded_file])
+            render_result("✅ Análise Concluída!", analysis_result)
+
+            st.success("Sua análise foi concluída! Para continuar e obter uma apuração precisa, preencha seus dados abaixo.")
+            render_contact_form()
+
+        else:
+            st.error("Não foi possível processar o extrato CNIS. Por favor, tente novamente com um arquivo válido ou verifique o formato.")
+
+    elif len(uploaded_files) > 1:
+        if pinned_results(uploaded_files) is None:
+            st.info(f"Analisando {len(uploaded_files)} extratos... O resultado de cada um aparece assim que fica pronto.")
+
+        results = analyze_cnis_pdfs(uploaded_files)
+        analyzed = [pdf_file for pdf_file, result in zip(uploaded_files, results) if result["success"]]
+
+        if analyzed:
+            combined = pinned_combined(uploaded_files, results)
+            keep_analysis(combined, analyzed)
+            render_result(f"✅ Total dos {len(analyzed)} extratos analisados", combined)
+
+            if len(analyzed) < len(uploaded_files):
+                st.warning("Alguns extratos não puderam ser processados e não entram no total. Verifique os arquivos indicados acima.")
+            st.success("Sua análise foi concluída! Para continuar e obter uma apuração precisa, preencha seus dados abaixo.")
+            render_contact_form()
+
+        else:
+            st.error("Não foi possível processar os extratos CNIS. Por favor, tente novamente com arquivos válidos ou verifique o formato.")
+
+    if DEBUG_PANEL:
+        render_debug_panel()
+
 
+if __name__ == "__main__":
+    main()
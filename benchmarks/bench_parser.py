@@ -0,0 +1,190 @@
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+from cnis.parser import parse_cnis_records
+
+# ----------------------------------------------------------------------
+# BENCHMARK DO PARSER DO CNIS
+# ----------------------------------------------------------------------
+# Compara o parser atual (cnis/parser.py) com a implementação anterior
+# (split do texto por "Código Emp." seguido de regex por bloco), mantida aqui como
+# referência:
+#   1. os dois devem produzir exatamente os mesmos registros e avisos em um conjunto
+#      dourado de extratos sintéticos (e em PDFs reais, se informados); as colunas
+#      tipadas do parser atual são convertidas de volta para dicionários na comparação;
+#   2. a vazão de cada um é medida em MB de texto por segundo (o parser atual, até as
+#      colunas tipadas; o anterior, até a lista de dicionários).
+#
+#   python -m benchmarks.bench_parser
+#   python -m benchmarks.bench_parser extrato1.pdf extrato2.pdf --repeat 10 --json
+#
+# Retorna código 1 se algum extrato divergir.
+# ----------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------
+# Parser de referência (implementação anterior)
+# ----------------------------------------------------------------------
+def legacy_records(page_texts, diagnostics):
+    texto_completo = "".join(page_texts)
+    blocos = re.split(r"Código Emp\.", texto_completo)
+
+    CNPJ_RE = r"\d{2}\.\d{3}\.\d{3}(?:/\d{4}-\d{2})?"
+    re_cnpj_bloco = re.compile(CNPJ_RE)
+    re_simples = re.compile(r"^(\d{2}/\d{4})\s+([\d.,]+)$", re.MULTILINE)
+    re_agrup = re.compile(
+        rf"""
+          ^(\d{{2}}/\d{{4}})
+          \s+({CNPJ_RE})
+          (?:\s+({CNPJ_RE}))?
+          \s+.*?
+          \s+([\d.,]+)$
+        """,
+        re.MULTILINE | re.VERBOSE,
+    )
+
+    records = []
+    for bloco in blocos:
+        bloco = bloco.strip()
+        if "AGRUPAMENTO DE CONTRATANTES/COOPERATIVAS" in bloco:
+            for comp, cnpj1, cnpj2, val in re_agrup.findall(bloco):
+                try:
+                    records.append({"Competência": comp, "CNPJ": cnpj1, "Salário": float(val.replace(".", "").replace(",", "."))})
+                except ValueError:
+                    diagnostics.append({"level": "warning", "message": f"Não foi possível converter o salário '{val}' para número na competência {comp} (agrupamento). Ignorando registro."})
+        else:
+            cnpj_match = re_cnpj_bloco.search(bloco)
+            if not cnpj_match:
+                continue
+            cnpj_bloco = cnpj_match.group(0)
+            for comp, val in re_simples.findall(bloco):
+                try:
+                    records.append({"Competência": comp, "CNPJ": cnpj_bloco, "Salário": float(val.replace(".", "").replace(",", "."))})
+                except ValueError:
+                    diagnostics.append({"level": "warning", "message": f"Não foi possível converter o salário '{val}' para número na competência {comp} (simples). Ignorando registro."})
+    return records
+
+
+def current_records(page_texts, diagnostics):
+    return list(parse_cnis_records(page_texts, diagnostics).rows())
+
+
+# ----------------------------------------------------------------------
+# Conjunto dourado: extratos sintéticos no layout de texto do PyMuPDF
+# ----------------------------------------------------------------------
+LINES_PER_PAGE = 50
+
+
+def _brl(value):
+    return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def synthetic_extract(n_employers, years, seed, agrupamento=True, noise=False):
+    # Páginas de texto de um extrato: um bloco por vínculo, com a competência e o valor
+    # ora na mesma linha, ora em linhas separadas; o último vínculo pode ser um agrupamento.
+    rnd = random.Random(seed)
+    lines = ["CNIS - Cadastro Nacional de Informações Sociais", "Extrato Previdenciário", ""]
+    for e in range(n_employers):
+        cnpj = f"{rnd.randint(10, 99)}.{rnd.randint(100, 999)}.{rnd.randint(100, 999)}/0001-{rnd.randint(10, 99)}"
+        lines += ["Código Emp.", str(e + 1), cnpj, f"EMPRESA {e} LTDA", "Competência", "Remuneração"]
+        grupo = agrupamento and e == n_employers - 1
+        if grupo:
+            lines.append("AGRUPAMENTO DE CONTRATANTES/COOPERATIVAS")
+        for year in range(2026 - years, 2026):
+            for month in range(1, 13):
+                value = _brl(rnd.uniform(1000, 9000))
+                if noise and rnd.random() < 0.02:
+                    value = rnd.choice(["1.2.3", ",", "..."])   # valores inválidos geram avisos
+                if grupo:
+                    lines.append(f"{month:02d}/{year} {cnpj} 11.222.333/0001-44 IREM {value}")
+                elif rnd.random() < 0.5:
+                    lines += [f"{month:02d}/{year}", value]
+                else:
+                    lines.append(f"{month:02d}/{year} {value}")
+                if noise and rnd.random() < 0.05:
+                    lines.append(rnd.choice(["", "   ", "PREV", "Indicadores: PEXT", "01/2020 x"]))
+    text = "\n".join(lines) + "\n"
+    return [text[i:i + LINES_PER_PAGE * 20] for i in range(0, len(text), LINES_PER_PAGE * 20)]
+
+
+def golden_set():
+    return {
+        "simples-1-vinculo": synthetic_extract(1, 10, seed=1, agrupamento=False),
+        "simples-5-vinculos": synthetic_extract(5, 15, seed=2, agrupamento=False),
+        "agrupamento": synthetic_extract(3, 12, seed=3),
+        "ruido": synthetic_extract(4, 20, seed=4, noise=True),
+        "longo": synthetic_extract(20, 30, seed=5),
+    }
+
+
+def pdf_pages(path):
+    import fitz
+    doc = fitz.open(path)
+    try:
+        return [page.get_text() for page in doc]
+    finally:
+        doc.close()
+
+
+# ----------------------------------------------------------------------
+# Execução
+# ----------------------------------------------------------------------
+def throughput(parse, page_texts, repeat):
+    # Melhor de `repeat` execuções, em MB de texto por segundo
+    size_mb = sum(len(t.encode("utf-8")) for t in page_texts) / 1e6
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(page_texts, [])
+        best = min(best, time.perf_counter() - started)
+    return size_mb / best if best else float("inf")
+
+
+def run(extracts, repeat):
+    report = []
+    for name, page_texts in extracts.items():
+        legacy_diag, current_diag = [], []
+        legacy = legacy_records(page_texts, legacy_diag)
+        current = current_records(page_texts, current_diag)
+        report.append({
+            "extrato": name,
+            "mb": round(sum(len(t.encode("utf-8")) for t in page_texts) / 1e6, 3),
+            "registros": len(current),
+            "identico": legacy == current and legacy_diag == current_diag,
+            "mb_s_anterior": round(throughput(legacy_records, page_texts, repeat), 2),
+            "mb_s_atual": round(throughput(parse_cnis_records, page_texts, repeat), 2),
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_parser", description="Compara e mede os parsers do CNIS.")
+    parser.add_argument("pdfs", nargs="*", help="extratos CNIS em PDF para incluir no conjunto dourado")
+    parser.add_argument("--repeat", type=int, default=5, help="repetições por extrato (usa a melhor)")
+    parser.add_argument("--json", action="store_true", help="emite o relatório em JSON")
+    args = parser.parse_args(argv)
+
+    extracts = golden_set()
+    for path in args.pdfs:
+        extracts[path] = pdf_pages(path)
+
+    report = run(extracts, args.repeat)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"  {'extrato':<24} {'MB':>7} {'registros':>10} {'anterior':>12} {'atual':>12}  resultado")
+        for row in report:
+            status = "idêntico" if row["identico"] else "DIVERGENTE"
+            print(f"  {row['extrato']:<24} {row['mb']:>7.3f} {row['registros']:>10} "
+                  f"{row['mb_s_anterior']:>7.2f} MB/s {row['mb_s_atual']:>7.2f} MB/s  {status}")
+
+    return 0 if all(row["identico"] for row in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
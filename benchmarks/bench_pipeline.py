@@ -0,0 +1,223 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from benchmarks.synthetic import generate_cnis_pdf
+
+# ----------------------------------------------------------------------
+# BENCHMARK DE ESCALABILIDADE DA ANÁLISE
+# ----------------------------------------------------------------------
+# Gera extratos sintéticos de 1 a 1000 páginas (benchmarks/synthetic.py), roda
+# analyze_pdf_bytes sobre eles e lê o tempo de cada etapa dos marcadores de
+# AnalysisMetrics (cnis/metrics.py), os mesmos das métricas do app:
+#   open         fitz.open sobre os bytes do PDF
+#   extract      page.get_text() de todas as páginas (cnis/extract.py); com --prescan,
+#                só das páginas que podem ter competências da janela de 5 anos
+#   parse        parser + montagem do DataFrame (records_frame), sem a extração
+#   contrib      cálculo vetorizado do INSS sobre os meses ordinais (add_contributions)
+#   aggregation  contribuição a maior por competência + janela de 5 anos (add_overpayments, summarize)
+#
+# Os tempos são o melhor de --repeat execuções, após uma de aquecimento. O pico de
+# memória de cada etapa é medido em uma execução à parte, com tracemalloc (só
+# alocações feitas pelo Python; a memória interna do MuPDF aparece apenas no RSS
+# máximo do processo). Como as páginas são extraídas sob demanda pelo parser, a
+# memória da extração entra no pico de "parse".
+#
+#   python -m benchmarks.bench_pipeline -o atual.json
+#   python -m benchmarks.bench_pipeline --sizes 1 10 100 --baseline anterior.json
+#   python -m benchmarks.bench_pipeline --prescan --baseline atual.json
+#
+# Com --baseline, cada etapa é comparada à mesma etapa e tamanho do arquivo anterior;
+# o código de saída é 1 se alguma ficar mais lenta que --threshold (padrão: 25%).
+# ----------------------------------------------------------------------
+
+DEFAULT_SIZES = (1, 10, 100, 1000)
+STAGES = ("open", "extract", "parse", "contrib", "aggregation")
+REFERENCE_DATE = "2026-01-01"
+
+# Etapas mais rápidas que isso não entram na comparação: o ruído domina a medida
+MIN_COMPARABLE_SECONDS = 0.002
+
+
+def run_analysis(pdf_bytes, reference_date, extract_workers=1, prescan=False):
+    # Roda analyze_pdf_bytes, o mesmo caminho do app; as etapas são medidas pelos
+    # marcadores de AnalysisMetrics.stage (cnis/metrics.py). Devolve o resultado e as
+    # medidas fechadas (AnalysisMetrics.as_dict).
+    import pandas as pd
+    from cnis.analysis import analyze_pdf_bytes
+    from cnis.metrics import AnalysisMetrics
+
+    metrics = AnalysisMetrics()
+    result = analyze_pdf_bytes(pdf_bytes, today=pd.Timestamp(reference_date), extract_workers=extract_workers, metrics=metrics,
+                               prescan=prescan)
+    if not result["success"]:
+        raise RuntimeError(f"A análise do extrato sintético falhou: {result['diagnostics']}")
+    return result, metrics.as_dict(result["success"])
+
+
+def stage_seconds(entry):
+    return {stage: entry["stages"].get(stage, {}).get("wall_seconds", 0.0) for stage in STAGES}
+
+
+def measure_memory(pdf_bytes, reference_date, extract_workers=1, prescan=False):
+    # Pico de memória alocada pelo Python em cada etapa, em bytes: com o tracemalloc
+    # ligado, AnalysisMetrics.stage registra memory_peak_bytes de cada etapa
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        _, entry = run_analysis(pdf_bytes, reference_date, extract_workers, prescan)
+    finally:
+        if started:
+            tracemalloc.stop()
+    return {stage: values["memory_peak_bytes"] for stage, values in entry["stages"].items() if "memory_peak_bytes" in values}
+
+
+def max_rss_bytes():
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é em KiB no Linux e em bytes no macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def benchmark_size(pages, repeat, employers, years, agrupamento, seed, extract_workers, prescan=False):
+    started = time.perf_counter()
+    pdf_bytes = generate_cnis_pdf(pages=pages, employers=employers, years=years, agrupamento=agrupamento, seed=seed)
+    generate_seconds = time.perf_counter() - started
+
+    # Execução de aquecimento, descartada: importações e caches internos do pandas e do MuPDF
+    run_analysis(pdf_bytes, REFERENCE_DATE, extract_workers, prescan)
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        result, entry = run_analysis(pdf_bytes, REFERENCE_DATE, extract_workers, prescan)
+        seconds = stage_seconds(entry)
+        best = seconds if best is None else {stage: min(best[stage], seconds[stage]) for stage in STAGES}
+
+    return {
+        "pages": pages,
+        "pdf_bytes": len(pdf_bytes),
+        "text_chars": entry["text_chars"],
+        "records": entry["records"],
+        "total_contribuicoes_a_maior": round(float(result["total_contribuicoes_a_maior"]), 2),
+        "generate_seconds": round(generate_seconds, 4),
+        "seconds": {stage: round(best[stage], 6) for stage in STAGES},
+        "total_seconds": round(sum(best.values()), 6),
+        "pages_per_second": round(pages / sum(best.values()), 2),
+        "pages_skipped": entry["pages_skipped"],
+        "peak_memory_bytes": measure_memory(pdf_bytes, REFERENCE_DATE, extract_workers, prescan),
+        "max_rss_bytes": max_rss_bytes(),
+    }
+
+
+def _git_commit():
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def run_suite(sizes=DEFAULT_SIZES, repeat=3, employers=4, years=30, agrupamento=1, seed=0, extract_workers=1, prescan=False,
+              progress=None):
+    from cnis.inss import INSS_TABLES_VERSION
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "inss_tables_version": INSS_TABLES_VERSION,
+            "repeat": repeat,
+            "extract_workers": extract_workers,
+            "prescan": prescan,
+            "generator": {"employers": employers, "years": years, "agrupamento": agrupamento, "seed": seed},
+        },
+        "results": [],
+    }
+    for pages in sizes:
+        entry = benchmark_size(pages, repeat, employers, years, agrupamento, seed, extract_workers, prescan)
+        report["results"].append(entry)
+        if progress:
+            progress(entry)
+    return report
+
+
+def compare(report, baseline, threshold):
+    # Regressões por etapa e tamanho em relação ao relatório anterior
+    previous = {entry["pages"]: entry for entry in baseline["results"]}
+    regressions = []
+    for entry in report["results"]:
+        old = previous.get(entry["pages"])
+        if old is None:
+            continue
+        for stage in STAGES:
+            before, after = old["seconds"].get(stage), entry["seconds"][stage]
+            if before is None or max(before, after) < MIN_COMPARABLE_SECONDS:
+                continue
+            ratio = after / before if before else float("inf")
+            if ratio > 1 + threshold:
+                regressions.append({"pages": entry["pages"], "stage": stage, "before": before, "after": after, "ratio": round(ratio, 3)})
+    return regressions
+
+
+def _print_entry(entry):
+    stages = "  ".join(f"{stage} {entry['seconds'][stage] * 1000:8.1f}" for stage in STAGES)
+    peak = max(entry["peak_memory_bytes"].values()) / 2**20
+    print(f"  {entry['pages']:>5} págs {entry['records']:>7} regs  {stages}  total {entry['total_seconds'] * 1000:8.1f} ms"
+          f"  pico {peak:7.1f} MiB", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_pipeline", description="Mede cada etapa da análise em extratos sintéticos.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="tamanhos, em páginas")
+    parser.add_argument("--repeat", type=int, default=3, help="repetições por tamanho (usa a melhor)")
+    parser.add_argument("--employers", type=int, default=4, help="vínculos por ciclo do gerador")
+    parser.add_argument("--years", type=int, default=30, help="anos de histórico por vínculo")
+    parser.add_argument("--agrupamento", type=int, default=1, help="seções de agrupamento por ciclo")
+    parser.add_argument("--seed", type=int, default=0, help="semente do gerador")
+    parser.add_argument("--extract-workers", type=int, default=1, help="processos de extração (1 = serial, mais estável para comparar)")
+    parser.add_argument("--prescan", action="store_true", help="extrai só as páginas da janela (iter_window_page_texts)")
+    parser.add_argument("-o", "--output", default=None, help="grava o relatório JSON neste arquivo")
+    parser.add_argument("--baseline", default=None, help="relatório JSON anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerância de lentidão por etapa (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    print(f"  etapas em ms: {', '.join(STAGES)}", file=sys.stderr)
+    report = run_suite(args.sizes, args.repeat, args.employers, args.years, args.agrupamento, args.seed,
+                       args.extract_workers, args.prescan, progress=_print_entry)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline"] = {"commit": baseline["meta"].get("commit"), "threshold": args.threshold,
+                              "regressions": compare(report, baseline, args.threshold)}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    regressions = report.get("baseline", {}).get("regressions", [])
+    for r in regressions:
+        print(f"  REGRESSÃO: {r['stage']} em {r['pages']} págs: {r['before'] * 1000:.1f} -> {r['after'] * 1000:.1f} ms "
+              f"({r['ratio']:.2f}x)", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
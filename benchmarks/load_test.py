@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from benchmarks.bench_pipeline import _git_commit, max_rss_bytes
+from benchmarks.synthetic import generate_cnis_pdf
+
+# ----------------------------------------------------------------------
+# TESTE DE CARGA DO APP (sessões simultâneas)
+# ----------------------------------------------------------------------
+# Simula N usuários ao mesmo tempo sobre o app.py, com o AppTest do Streamlit: cada
+# sessão é um AppTest próprio, executado em uma thread, e todas compartilham o mesmo
+# processo (e, portanto, os recursos de st.cache_resource: cache de resultados, fila
+# de análises, pool de extração), como as sessões de um servidor Streamlit real.
+# Cada usuário percorre o roteiro:
+#   load    primeira execução do script (página inicial)
+#   upload  envio de um extrato sintético (benchmarks/synthetic.py) e análise
+#   rerun   nova execução do script com o mesmo upload (ex.: interação com a página)
+#   submit  preenchimento e envio do formulário de contato
+#
+# Para cada nível de concorrência (--sessions), --iterations usuários passam por cada
+# uma das N threads, um após o outro. O relatório traz, por nível: latência de cada
+# passo e de todos juntos (p50/p95/p99 e máximo, em segundos), vazão (usuários e
+# execuções do script por segundo) e a memória residente do processo (no início, no
+# fim e o pico amostrado durante o nível).
+#
+#   python -m benchmarks.load_test
+#   python -m benchmarks.load_test --sessions 1 4 16 --iterations 5 --pages 50 -o carga.json
+#   python -m benchmarks.load_test --cache-hits --baseline carga.json
+#
+# Por padrão, cada usuário envia um extrato diferente (todas as análises são feitas
+# de fato); com --cache-hits, todos enviam o mesmo e, depois do primeiro, o resultado
+# vem do cache. Leads, PDFs e registros vão para um diretório temporário e nenhum
+# lead é enviado ao CRM (CNIS_LEAD_WEBHOOK_URL é desligado).
+#
+# Com --baseline, o p95 de cada nível é comparado ao do relatório anterior; o código
+# de saída é 1 se algum ficar mais lento que --threshold (padrão: 25%) ou se alguma
+# sessão falhar.
+# ----------------------------------------------------------------------
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+DEFAULT_LEVELS = (1, 2, 4, 8)
+STEPS = ("load", "upload", "rerun", "submit")
+PERCENTILES = (50, 95, 99)
+
+# Intervalo de amostragem da memória residente durante cada nível, em segundos
+RSS_SAMPLE_SECONDS = 0.05
+
+# Latências menores que isso não entram na comparação: o ruído domina a medida
+MIN_COMPARABLE_SECONDS = 0.01
+
+LEAD_FORM = {"nome_completo": "Usuário de Teste", "email_contato": "carga@example.com",
+             "telefone_contato": "(11) 99999-0000"}
+
+
+def isolate_environment(directory):
+    # Tudo o que o app grava fica em `directory`; nada sai para o CRM. Precisa rodar
+    # antes da primeira sessão, quando os recursos do app leem o ambiente.
+    os.environ["CNIS_OUTBOX_DB"] = os.path.join(directory, "outbox.sqlite3")
+    os.environ["CNIS_UPLOAD_DIR"] = os.path.join(directory, "uploads")
+    os.environ["CNIS_LEAD_WEBHOOK_URL"] = ""
+    os.environ["CNIS_CACHE_DIR"] = ""
+    os.environ.pop("CNIS_RECORDS_DIR", None)
+
+
+def current_rss_bytes():
+    # Memória residente atual (Linux); fora dele, o máximo do processo até agora
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return max_rss_bytes()
+
+
+class RssSampler:
+    # Pico da memória residente enquanto o nível roda, amostrado em uma thread
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cnis-load-rss", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss_bytes()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+@contextmanager
+def concurrent_app_tests():
+    # O AppTest foi feito para uma sessão por vez: cada execução instala o seu Runtime
+    # simulado em Runtime._instance e o remove ao terminar, e compila o script de novo
+    # (ast.parse não é seguro entre threads no Python 3.11). Enquanto o teste roda, uma
+    # execução em andamento continua vendo o último Runtime instalado quando outra
+    # termina, e as compilações são feitas uma de cada vez.
+    from unittest import mock
+
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    installed = []
+    compile_lock = threading.Lock()
+    get_bytecode = ScriptCache.get_bytecode
+
+    def current(cls):
+        if cls._instance is not None:
+            installed[:] = [cls._instance]
+        return cls._instance if cls._instance is not None else (installed[0] if installed else None)
+
+    def instance(cls):
+        runtime = current(cls)
+        if runtime is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return runtime
+
+    def locked_get_bytecode(self, script_path):
+        with compile_lock:
+            return get_bytecode(self, script_path)
+
+    with mock.patch.object(Runtime, "instance", classmethod(instance)), \
+            mock.patch.object(Runtime, "exists", classmethod(lambda cls: current(cls) is not None)), \
+            mock.patch.object(ScriptCache, "get_bytecode", locked_get_bytecode):
+        yield
+
+
+# ----------------------------------------------------------------------
+# Uma sessão
+# ----------------------------------------------------------------------
+def _timed(run):
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+def run_session(pdf_bytes, name, timeout):
+    # Roteiro de um usuário; devolve (latência de cada passo, erro ou None)
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    timings = {"load": _timed(at.run)}
+    timings["upload"] = _timed(at.file_uploader[0].upload(name, pdf_bytes, "application/pdf").run)
+    if not any("result-value" in m.value for m in at.markdown):
+        return timings, _session_error(at, "a análise não exibiu resultado")
+    timings["rerun"] = _timed(at.run)
+    for key, value in LEAD_FORM.items():
+        at.text_input(key=key).input(value)
+    timings["submit"] = _timed(at.button[0].click().run)
+    if not any("Dados enviados com sucesso" in s.value for s in at.success):
+        return timings, _session_error(at, "o formulário não foi aceito")
+    return timings, _session_error(at, None)
+
+
+def _session_error(at, default):
+    messages = [str(e.value) for e in at.exception] + [e.value for e in at.error]
+    return messages[0] if messages else default
+
+
+# ----------------------------------------------------------------------
+# Níveis de concorrência
+# ----------------------------------------------------------------------
+def percentile(values, p):
+    # Método do posto mais próximo, como em cnis/metrics.py
+    ordered = sorted(values)
+    return ordered[max(0, -(-p * len(ordered) // 100) - 1)]
+
+
+def latency_summary(values):
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values)}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = round(percentile(values, p), 4)
+    summary["max"] = round(max(values), 4)
+    return summary
+
+
+def run_level(sessions, iterations, pdfs, timeout):
+    # `pdfs`: um extrato para cada usuário do nível (sessions * iterations)
+    from cnis.metrics import REGISTRY
+
+    samples = {step: [] for step in STEPS}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(thread):
+        for iteration in range(iterations):
+            user = thread * iterations + iteration
+            timings, error = run_session(pdfs[user], f"extrato-{user}.pdf", timeout)
+            with lock:
+                for step, seconds in timings.items():
+                    samples[step].append(seconds)
+                if error:
+                    errors.append(error)
+
+    analyses_before = REGISTRY.totals()["analyses"]
+    rss_start = current_rss_bytes()
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="cnis-load") as pool:
+            for future in [pool.submit(worker, thread) for thread in range(sessions)]:
+                future.result()
+        wall = time.perf_counter() - started
+
+    users = sessions * iterations
+    runs = sum(len(values) for values in samples.values())
+    return {
+        "sessions": sessions,
+        "users": users,
+        "failed_users": len(errors),
+        "errors": sorted(set(errors)),
+        "analyses": REGISTRY.totals()["analyses"] - analyses_before,
+        "wall_seconds": round(wall, 4),
+        "users_per_second": round(users / wall, 3),
+        "runs_per_second": round(runs / wall, 3),
+        "latency": {step: latency_summary(samples[step]) for step in STEPS},
+        "latency_all": latency_summary([s for values in samples.values() for s in values]),
+        "rss_bytes": {"start": rss_start, "end": current_rss_bytes(), "peak": sampler.peak},
+    }
+
+
+def run_suite(levels=DEFAULT_LEVELS, iterations=3, pages=10, seed=0, cache_hits=False, timeout=120.0, progress=None):
+    from cnis.inss import INSS_TABLES_VERSION
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "inss_tables_version": INSS_TABLES_VERSION,
+            "iterations": iterations,
+            "pages": pages,
+            "cache_hits": cache_hits,
+            "seed": seed,
+        },
+        "results": [],
+    }
+    shared = generate_cnis_pdf(pages=pages, seed=seed) if cache_hits else None
+    next_seed = seed
+    with concurrent_app_tests():
+        for sessions in levels:
+            # Extratos gerados antes de o nível começar (fora da medida); sem --cache-hits,
+            # sementes novas a cada nível, para que nenhum resultado venha do cache
+            users = sessions * iterations
+            if cache_hits:
+                pdfs = [shared] * users
+            else:
+                pdfs = [generate_cnis_pdf(pages=pages, seed=next_seed + user + 1) for user in range(users)]
+                next_seed += users
+            entry = run_level(sessions, iterations, pdfs, timeout)
+            report["results"].append(entry)
+            if progress:
+                progress(entry)
+    report["meta"]["max_rss_bytes"] = max_rss_bytes()
+    return report
+
+
+def compare(report, baseline, threshold):
+    # Níveis cujo p95 (todos os passos) piorou em relação ao relatório anterior
+    previous = {entry["sessions"]: entry for entry in baseline["results"]}
+    regressions = []
+    for entry in report["results"]:
+        old = previous.get(entry["sessions"])
+        if old is None or not old["latency_all"].get("p95") or not entry["latency_all"].get("p95"):
+            continue
+        before, after = old["latency_all"]["p95"], entry["latency_all"]["p95"]
+        if max(before, after) < MIN_COMPARABLE_SECONDS:
+            continue
+        ratio = after / before
+        if ratio > 1 + threshold:
+            regressions.append({"sessions": entry["sessions"], "before": before, "after": after, "ratio": round(ratio, 3)})
+    return regressions
+
+
+def _print_entry(entry):
+    latency = entry["latency_all"]
+    steps = "  ".join(f"{step} {entry['latency'][step].get('p95', 0) * 1000:7.0f}" for step in STEPS)
+    print(f"  {entry['sessions']:>3} sessões {entry['users']:>4} usuários  "
+          f"p50 {latency.get('p50', 0) * 1000:7.0f}  p95 {latency.get('p95', 0) * 1000:7.0f}  p99 {latency.get('p99', 0) * 1000:7.0f} ms"
+          f"  |  p95 por passo: {steps}  |  {entry['users_per_second']:6.2f} usuários/s"
+          f"  RSS pico {entry['rss_bytes']['peak'] / 2**20:7.1f} MiB  falhas {entry['failed_users']}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_test", description="Simula sessões simultâneas do app e mede latência, vazão e memória.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=list(DEFAULT_LEVELS), help="níveis de concorrência (sessões simultâneas)")
+    parser.add_argument("--iterations", type=int, default=3, help="usuários por sessão simultânea, um após o outro")
+    parser.add_argument("--pages", type=int, default=10, help="páginas de cada extrato sintético")
+    parser.add_argument("--seed", type=int, default=0, help="semente do gerador")
+    parser.add_argument("--cache-hits", action="store_true", help="todos os usuários enviam o mesmo extrato (resultado vem do cache)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="prazo de cada execução do script, em segundos")
+    parser.add_argument("-o", "--output", default=None, help="grava o relatório JSON neste arquivo")
+    parser.add_argument("--baseline", default=None, help="relatório JSON anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerância de piora do p95 por nível (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="cnis-load-") as directory:
+        isolate_environment(directory)
+        print("  latências em ms (todos os passos; p95 de cada passo: " + ", ".join(STEPS) + ")", file=sys.stderr)
+        report = run_suite(args.sessions, args.iterations, args.pages, args.seed, args.cache_hits, args.timeout,
+                           progress=_print_entry)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline"] = {"commit": baseline["meta"].get("commit"), "threshold": args.threshold,
+                              "regressions": compare(report, baseline, args.threshold)}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    regressions = report.get("baseline", {}).get("regressions", [])
+    for r in regressions:
+        print(f"  REGRESSÃO: p95 com {r['sessions']} sessões: {r['before'] * 1000:.0f} -> {r['after'] * 1000:.0f} ms "
+              f"({r['ratio']:.2f}x)", file=sys.stderr)
+    failed = sum(entry["failed_users"] for entry in report["results"])
+    if failed:
+        print(f"  {failed} usuário(s) com falha; veja \"errors\" no relatório", file=sys.stderr)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import argparse
+import random
+import sys
+
+# ----------------------------------------------------------------------
+# GERADOR DE EXTRATOS CNIS SINTÉTICOS
+# ----------------------------------------------------------------------
+# Escreve, com o PyMuPDF, PDFs no layout do extrato previdenciário: cabeçalho em
+# cada página, um bloco por vínculo ("Código Emp.", CNPJ, nome, datas) seguido da
+# tabela de remunerações (competência, valor e, às vezes, indicadores), e seções
+# "AGRUPAMENTO DE CONTRATANTES/COOPERATIVAS" com os CNPJs na própria linha.
+# Cada célula é posicionada separadamente, como nos extratos reais, e o texto
+# extraído sai uma célula por linha.
+#
+#   python -m benchmarks.synthetic extrato.pdf --pages 100
+#   python -m benchmarks.synthetic extrato.pdf --employers 5 --years 20 --agrupamento 2
+#
+# Com --pages, vínculos são acrescentados até o documento ter exatamente esse número
+# de páginas; sem ele, são escritos --employers vínculos com --years anos cada.
+# A mesma semente gera sempre o mesmo documento.
+# ----------------------------------------------------------------------
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842       # A4, em pontos
+MARGIN_TOP, MARGIN_BOTTOM = 50, 60
+LINE_HEIGHT = 11
+FONT_SIZE = 7
+
+COLUMNS = (40, 110, 200, 300, 400, 480)  # posição x de cada célula da linha
+PAGE_HEADER = (
+    ("INSS - Instituto Nacional do Seguro Social",),
+    ("CNIS - Cadastro Nacional de Informações Sociais", "Extrato Previdenciário"),
+)
+INDICADORES = ("IREM-INDPEND", "PREM-EXT", "AVRC-DEF", "PEXT")
+DEFAULT_END = (2025, 12)
+
+
+def _brl(value):
+    return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _cnpj(rnd):
+    return f"{rnd.randint(10, 99)}.{rnd.randint(100, 999)}.{rnd.randint(100, 999)}/{rnd.randint(1, 9):04d}-{rnd.randint(10, 99)}"
+
+
+def _competences(years, end, shift_years):
+    # Competências de `years` anos terminando em `end`, deslocadas `shift_years` anos para trás
+    end_ordinal = end[0] * 12 + end[1] - 1 - shift_years * 12
+    for ordinal in range(end_ordinal - years * 12 + 1, end_ordinal + 1):
+        yield f"{ordinal % 12 + 1:02d}/{ordinal // 12}"
+
+
+def _employer_rows(rnd, seq, years, end, shift_years, agrupamento):
+    cnpj = _cnpj(rnd)
+    competences = list(_competences(years, end, shift_years))
+    yield ("Seq.", "NIT", "Código Emp.", "Origem do Vínculo", "Data Início", "Data Fim")
+    yield (str(seq), f"{rnd.randint(100, 999)}.{rnd.randint(10000, 99999)}.{rnd.randint(10, 99)}-{rnd.randint(0, 9)}",
+           cnpj, f"EMPRESA SINTETICA {seq} LTDA", "01/" + competences[0], "")
+    base = rnd.uniform(1500, 12000)
+
+    if agrupamento:
+        yield ("AGRUPAMENTO DE CONTRATANTES/COOPERATIVAS",)
+        yield ("Competência", "Contrat.", "Cooperativa", "Indicadores", "Remuneração")
+        cooperativa = _cnpj(rnd)
+        for comp in competences:
+            value = _brl(base * rnd.uniform(0.8, 1.2))
+            if rnd.random() < 0.5:
+                yield (comp, cnpj, cooperativa, rnd.choice(INDICADORES), value)
+            else:
+                yield (comp, cnpj, rnd.choice(INDICADORES), value)
+    else:
+        yield ("Remunerações",)
+        yield ("Competência", "Remuneração", "Indicadores")
+        for comp in competences:
+            value = _brl(base * rnd.uniform(0.8, 1.2))
+            if rnd.random() < 0.1:
+                yield (comp, value, rnd.choice(INDICADORES))
+            else:
+                yield (comp, value)
+
+
+def _rows(rnd, employers, years, agrupamento, end, unlimited):
+    # Linhas do extrato. Com unlimited, os vínculos continuam indefinidamente: a cada
+    # ciclo de `employers` vínculos o histórico recua `years` anos, voltando ao fim
+    # quando passaria de 1995. Documentos muito longos acabam sobrepondo ciclos, com
+    # mais de `employers` vínculos na mesma competência.
+    slots = max(1, (end[0] - 1995) // years)
+    cycle = 0
+    while True:
+        for k in range(employers):
+            seq = cycle * employers + k + 1
+            shift = (cycle % slots) * years
+            yield from _employer_rows(rnd, seq, years, end, shift, k >= employers - agrupamento)
+        cycle += 1
+        if not unlimited:
+            return
+
+
+def generate_cnis_pdf(pages=None, employers=3, years=10, agrupamento=1, seed=0, end=DEFAULT_END):
+    # Devolve os bytes do PDF
+    import fitz
+
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    rows = _rows(rnd, employers, years, min(agrupamento, employers), end, unlimited=pages is not None)
+    rows_per_page = (PAGE_HEIGHT - MARGIN_TOP - MARGIN_BOTTOM) // LINE_HEIGHT - len(PAGE_HEADER) - 1
+
+    # Um TextWriter por página: cada célula continua sendo um trecho de texto separado,
+    # mas a página recebe um único fluxo de conteúdo (insert_text por célula fica
+    # proibitivo em documentos de centenas de páginas).
+    font = fitz.Font("helv")
+    done = False
+    while not done and (pages is None or len(doc) < pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        writer = fitz.TextWriter(page.rect)
+        y = MARGIN_TOP
+        for header in PAGE_HEADER:
+            for x, text in zip(COLUMNS[::3], header):
+                writer.append((x, y), text, font=font, fontsize=FONT_SIZE)
+            y += LINE_HEIGHT
+        y += LINE_HEIGHT
+        for _ in range(rows_per_page):
+            row = next(rows, None)
+            if row is None:
+                done = True
+                break
+            for x, text in zip(COLUMNS, row):
+                if text:
+                    writer.append((x, y), text, font=font, fontsize=FONT_SIZE)
+            y += LINE_HEIGHT
+        writer.append((PAGE_WIDTH - 90, PAGE_HEIGHT - 30), f"Página {len(doc)}", font=font, fontsize=FONT_SIZE)
+        writer.write_text(page)
+
+    try:
+        return doc.tobytes(garbage=3, deflate=True)
+    finally:
+        doc.close()
+
+
+def write_cnis_pdf(path, **kwargs):
+    pdf_bytes = generate_cnis_pdf(**kwargs)
+    with open(path, "wb") as f:
+        f.write(pdf_bytes)
+    return len(pdf_bytes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.synthetic", description="Gera um extrato CNIS sintético em PDF.")
+    parser.add_argument("output", help="arquivo PDF de saída")
+    parser.add_argument("--pages", type=int, default=None, help="número exato de páginas (acrescenta vínculos até completar)")
+    parser.add_argument("--employers", type=int, default=3, help="vínculos (por ciclo, com --pages)")
+    parser.add_argument("--years", type=int, default=10, help="anos de histórico por vínculo")
+    parser.add_argument("--agrupamento", type=int, default=1, help="quantos vínculos do ciclo são seções de agrupamento")
+    parser.add_argument("--seed", type=int, default=0, help="semente do gerador")
+    args = parser.parse_args(argv)
+
+    size = write_cnis_pdf(args.output, pages=args.pages, employers=args.employers, years=args.years,
+                          agrupamento=args.agrupamento, seed=args.seed)
+    print(f"{args.output}: {size} bytes", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# Pacote com o núcleo da análise do CNIS, sem dependência do Streamlit:
+#   cnis.inss      tabelas do INSS (cnis/data/inss_tables.json) e cálculo das contribuições
+#   cnis.parser    parser do extrato CNIS (streaming, página a página)
+#   cnis.extract   extração de texto do PDF (serial ou em pool de processos, ou só das páginas da janela)
+#   cnis.analysis  análise completa de um PDF (analyze_pdf_bytes)
+#   cnis.scheduler fila de análises do processo (concorrência limitada, prazo, recusa de PDFs grandes)
+#   cnis.export    exportação do detalhamento por competência e CNPJ (CSV/XLSX)
+#   cnis.cache     cache de resultados
+#   cnis.storage   armazenamento em disco dos PDFs enviados (endereçado por conteúdo)
+#   cnis.diskfiles gravação atômica, listagem e expiração dos arquivos em disco
+#   cnis.metrics   medidas de tempo, CPU e memória por etapa da análise
+#   cnis.records   registros extraídos em Parquet, reanálise e cenários sem reabrir o PDF
+#   cnis.outbox    fila de saída dos leads (SQLite), enviada ao CRM em segundo plano
+#   cnis.batch     processamento em lote pela linha de comando
+#   cnis.startup   medição do custo de importação de cada parte
+#
+# Os nomes abaixo são importados sob demanda, de modo que "import cnis" não carrega
+# NumPy, pandas nem PyMuPDF até que alguma função realmente precise deles.
+import importlib
+
+_LAZY_EXPORTS = {
+    "INSS_TABLES_VERSION": "cnis.inss",
+    "calculate_inss": "cnis.inss",
+    "calculate_inss_batch": "cnis.inss",
+    "get_inss_ceiling": "cnis.inss",
+    "get_max_contribution_batch": "cnis.inss",
+    "parse_cnis_records": "cnis.parser",
+    "analyze_pdf_bytes": "cnis.analysis",
+    "combine_results": "cnis.analysis",
+    "AnalysisScheduler": "cnis.scheduler",
+    "breakdown_export_bytes": "cnis.export",
+    "ResultCache": "cnis.cache",
+    "make_cache_key": "cnis.cache",
+    "UploadStore": "cnis.storage",
+    "RecordStore": "cnis.records",
+    "reanalyze": "cnis.records",
+    "sweep": "cnis.records",
+    "LeadOutbox": "cnis.outbox",
+}
+
+__all__ = list(_LAZY_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module 'cnis' has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,373 @@
+import logging
+import time
+
+import numpy as np
+
+from cnis.extract import (EXTRACT_WORKERS, PRESCAN_PAGES, get_process_pool, iter_page_texts, iter_window_page_texts,
+                          recycle_pool)
+from cnis.inss import calculate_inss_batch, get_max_contribution_batch
+from cnis.metrics import AnalysisMetrics, record_analysis, record_entry
+from cnis.parser import add_diagnostic, format_competence, parse_cnis_records
+
+logger = logging.getLogger(__name__)
+
+
+def _failure(diagnostics, page_count=0):
+    return {"success": False, "total_paginas": page_count, "diagnostics": diagnostics}
+
+
+RECORD_COLUMNS = ["Competência", "CNPJ", "Salário"]
+
+
+class AnalysisTimeout(Exception):
+    pass
+
+
+def _timeout_failure(timeout, page_count=0):
+    diagnostics = []
+    add_diagnostic(diagnostics, "error", f"A análise do extrato excedeu o tempo limite de {timeout:.0f} segundos. Tente novamente em alguns minutos.")
+    return _failure(diagnostics, page_count)
+
+
+# Folga, em segundos, além do prazo da análise para esperar o resultado de um processo
+# do pool (início do processo, envio do PDF e volta do resultado)
+POOL_TIMEOUT_MARGIN = 10.0
+
+
+# ----------------------------------------------------------------------
+# ETAPAS DA ANÁLISE
+# ----------------------------------------------------------------------
+# analyze_pdf_bytes encadeia: abertura do PDF, extração do texto, parsing,
+# cálculo das contribuições e agregação. As etapas a partir do parsing ficam em
+# funções próprias para que possam ser medidas isoladamente (ver benchmarks/).
+def records_frame(page_texts, diagnostics):
+    # O DataFrame é montado sobre as colunas tipadas do parser (RecordColumns):
+    #   Competência  int32, mês ordinal (ano * 12 + mês - 1); -1 se o mês for inválido
+    #   CNPJ         categórico (códigos int32 + lista de CNPJs distintos)
+    #   Salário      float64
+    return columns_frame(parse_cnis_records(page_texts, diagnostics))
+
+
+def columns_frame(records):
+    import pandas as pd
+    return pd.DataFrame({
+        "Competência": np.frombuffer(records.competences, dtype=np.int32),
+        "CNPJ": pd.Categorical.from_codes(np.frombuffer(records.cnpj_codes, dtype=np.int32), categories=records.cnpjs),
+        "Salário": np.frombuffer(records.salaries, dtype=np.float64),
+    }, columns=RECORD_COLUMNS)
+
+
+def add_contributions(df):
+    # Remove registros com mês inválido (sem data de competência)
+    invalid = df["Competência"].to_numpy() < 0
+    if invalid.any():
+        # Cópia explícita: as colunas são acrescentadas a seguir (no pandas < 3, fazê-lo
+        # sobre o recorte dispara SettingWithCopyWarning)
+        df = df[~invalid].copy()
+
+    # Calcula a contribuição INSS para cada registro, vetorizado sobre todas as linhas
+    # de uma vez, direto dos meses ordinais (ver calculate_inss_batch)
+    df["Contribuição"] = calculate_inss_batch(df["Salário"].to_numpy(), df["Competência"].to_numpy())
+    return df
+
+
+def add_overpayments(df):
+    import pandas as pd
+
+    # Contribuição a maior por competência, em uma única passagem vetorizada: soma das
+    # contribuições de todos os vínculos de cada competência (groupby-sum por código da
+    # competência), comparada com a contribuição máxima sobre o teto vigente, já
+    # pré-calculada no índice das tabelas. bincount soma na ordem dos registros, como
+    # Series.sum faz para grupos pequenos, mantendo os totais do cálculo anterior.
+    codigos, competencias = pd.factorize(df["Competência"])
+    total_por_competencia = np.bincount(codigos, weights=df["Contribuição"].to_numpy(), minlength=len(competencias))
+    excesso_por_competencia = np.maximum(total_por_competencia - get_max_contribution_batch(competencias), 0.0)
+
+    # Cada registro recebe a contribuição a maior da sua competência
+    df["Contribuição a maior"] = excesso_por_competencia[codigos]
+    return df
+
+
+def breakdown_frame(df):
+    # Detalhamento compacto do período analisado, guardado no resultado para exportação
+    # (ver cnis/export.py): uma linha por competência e CNPJ, com a remuneração, a
+    # contribuição e a contribuição a maior somadas por registro, como no total do
+    # resultado (a soma da coluna é total_contribuicoes_a_maior). Competência continua
+    # como mês ordinal e CNPJ como categórico.
+    frame = df.groupby(["Competência", "CNPJ"], observed=True, sort=True)[
+        ["Salário", "Contribuição", "Contribuição a maior"]].sum().reset_index()
+    frame["CNPJ"] = frame["CNPJ"].cat.remove_unused_categories()
+    return frame
+
+
+def window_bounds(today, window_years=5):
+    # Meses ordinais da primeira e da última competência analisadas: os últimos
+    # `window_years` anos completos (5, por padrão) até o mês de referência, inclusive.
+    # Com uma data de referência no passado, as competências posteriores ficam de fora.
+    end = today.year * 12 + today.month - 1
+    return end - window_years * 12, end
+
+
+def summarize(df, today, page_count, diagnostics, window_years=5):
+    start_cutoff, end_cutoff = window_bounds(today, window_years)
+
+    # Filtra o DataFrame para incluir apenas as competências dentro da janela
+    df_filtered = df[(df["Competência"] >= start_cutoff) & (df["Competência"] <= end_cutoff)]
+
+    if df_filtered.empty:
+        add_diagnostic(diagnostics, "warning", f"Nenhuma remuneração encontrada nos últimos {window_years} anos para análise.")
+        return {
+            "success": True,
+            "total_contribuicoes_a_maior": 0.0,
+            "total_registros": 0,
+            "total_competencias": 0,
+            "periodo_analisado": {
+                "inicio": "N/A",
+                "fim": "N/A"
+            },
+            "total_paginas": page_count,
+            "detalhamento": breakdown_frame(df_filtered),
+            "diagnostics": diagnostics,
+        }
+
+    total_registros = len(df_filtered) # Total de registros no período analisado
+    total_competencias = df_filtered["Competência"].nunique()
+    # Meses ordinais: mínimo e máximo em ordem cronológica
+    competencia_min = format_competence(int(df_filtered["Competência"].min()))
+    competencia_max = format_competence(int(df_filtered["Competência"].max()))
+
+    # Soma apenas as contribuições a maior do período filtrado (df_filtered já traz a
+    # coluna "Contribuição a maior" de cada registro)
+    total_contribuicoes_a_maior_final = df_filtered["Contribuição a maior"].sum()
+
+    return {
+        "success": True,
+        "total_contribuicoes_a_maior": total_contribuicoes_a_maior_final,
+        "total_registros": total_registros,
+        "total_competencias": total_competencias,
+        "periodo_analisado": {
+            "inicio": competencia_min,
+            "fim": competencia_max
+        },
+        "total_paginas": page_count,
+        "detalhamento": breakdown_frame(df_filtered),
+        "diagnostics": diagnostics,
+    }
+
+
+# ----------------------------------------------------------------------
+# FUNÇÃO PRINCIPAL DE ANÁLISE DO CNIS
+# ----------------------------------------------------------------------
+def analyze_pdf_bytes(pdf_bytes, today=None, extract_workers=None, metrics=None,
+                      window_years=5, record_store=None, record_key=None, prescan=None, timeout=None):
+    # Núcleo da análise, sem dependência de interface: erros e avisos são devolvidos
+    # em result["diagnostics"] para que cada chamador (app Streamlit, CLI em lote)
+    # decida como exibi-los. Em caso de falha, result["success"] é False.
+    #
+    # pdf_bytes pode ser bytes ou qualquer buffer contíguo (memoryview, mmap).
+    #
+    # Tempo, CPU e memória de cada etapa são medidos em `metrics` (ver cnis/metrics.py)
+    # e registrados ao final, com sucesso ou falha.
+    #
+    # Com `record_store` (cnis/records.py), os registros extraídos são gravados sob
+    # `record_key` (padrão: SHA-256 do PDF), para reanálises sem reabrir o PDF.
+    #
+    # Com `prescan` (padrão: CNIS_PRESCAN, desligado), extratos longos têm extraídas
+    # só as páginas que podem trazer competências da janela (iter_window_page_texts em
+    # cnis/extract.py); com `record_store`, o extrato é sempre extraído por inteiro.
+    #
+    # Com `timeout` (segundos), a análise desiste ao passar do prazo: o relógio é
+    # conferido entre uma página e outra, e o resultado é uma falha com o aviso.
+    metrics = AnalysisMetrics() if metrics is None else metrics
+    metrics.counts["bytes"] = len(pdf_bytes)
+    success = False
+    try:
+        result = _analyze(pdf_bytes, today, extract_workers, metrics, window_years, record_store, record_key, prescan, timeout)
+        success = result["success"]
+        return result
+    finally:
+        record_analysis(metrics, success)
+
+
+def _analyze(pdf_bytes, today, extract_workers, metrics, window_years, record_store, record_key, prescan=None, timeout=None):
+    # pandas (assim como o fitz, mais abaixo) é importado só na primeira chamada,
+    # para que importar o pacote cnis continue barato (ver cnis/startup.py).
+    import pandas as pd
+
+    if today is None:
+        today = pd.Timestamp.today().normalize()
+    diagnostics = []
+    page_count = 0
+    prescan = PRESCAN_PAGES if prescan is None else prescan
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    try:
+        # Importa fitz (PyMuPDF) aqui para garantir que a importação ocorra apenas se a função for chamada
+        # e para que o erro seja mais específico se PyMuPDF não estiver instalado.
+        import fitz 
+        with metrics.stage("open"):
+            # O MuPDF lê diretamente do buffer recebido (bytes, memoryview ou o mmap de
+            # cnis/storage.py), sem cópia; o buffer precisa existir até doc.close().
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            page_count = len(doc)
+        try:
+            # Fora da gravação de registros, a pré-varredura extrai só as páginas da janela
+            windowed = prescan and record_store is None
+            cutoff = window_bounds(today, window_years)[0] if windowed else None
+            df = _page_records(doc, pdf_bytes, extract_workers, metrics, diagnostics, deadline, cutoff)
+            if windowed and df.empty:
+                # Nenhum registro nas páginas mantidas (ex.: linhas da janela sem
+                # remuneração): o extrato inteiro decide entre o total zero e a falha
+                diagnostics.clear()
+                metrics.counts["pages_skipped"] = 0
+                df = _page_records(doc, pdf_bytes, extract_workers, metrics, diagnostics, deadline)
+            metrics.counts["records"] = len(df)
+        finally:
+            doc.close()
+    except ImportError:
+        add_diagnostic(diagnostics, "error", "Erro: A biblioteca 'PyMuPDF' (fitz) não está instalada. Por favor, adicione 'PyMuPDF' ao seu requirements.txt.")
+        return _failure(diagnostics, page_count)
+    except AnalysisTimeout:
+        return _timeout_failure(timeout, page_count)
+    except Exception as e:
+        add_diagnostic(diagnostics, "error", f"Erro ao extrair texto do PDF. Certifique-se de que é um PDF válido e não está protegido. Erro: {e}")
+        return _failure(diagnostics, page_count)
+
+    if df.empty:
+        add_diagnostic(diagnostics, "warning", "Nenhuma remuneração válida encontrada no extrato CNIS. Verifique o formato do arquivo.")
+        return _failure(diagnostics, page_count)
+
+    with metrics.stage("contrib"):
+        df = add_contributions(df)
+
+    if df.empty:
+        add_diagnostic(diagnostics, "warning", "Nenhuma competência válida encontrada após a conversão de datas.")
+        return _failure(diagnostics, page_count)
+
+    if record_store is not None:
+        with metrics.stage("persist"):
+            _persist_records(record_store, record_key, pdf_bytes, df, page_count)
+
+    with metrics.stage("aggregation"):
+        df = add_overpayments(df)
+        return summarize(df, today, page_count, diagnostics, window_years)
+
+
+def _page_records(doc, pdf_bytes, extract_workers, metrics, diagnostics, deadline, cutoff=None):
+    # O parser consome as páginas à medida que são extraídas: o tempo gasto obtendo
+    # cada página é contado na etapa "extract", o restante em "parse". Extratos longos
+    # têm o texto extraído em paralelo e, com `cutoff` (mês ordinal de início da
+    # janela), só das páginas da janela (ver cnis/extract.py).
+    if cutoff is None:
+        page_texts = iter_page_texts(doc, pdf_bytes, workers=extract_workers)
+    else:
+        page_texts = iter_window_page_texts(doc, cutoff, pdf_bytes, workers=extract_workers, counts=metrics.counts)
+    if deadline is not None:
+        page_texts = _pages_until(page_texts, deadline)
+    with metrics.stage("parse"):
+        return records_frame(metrics.timed_pages(page_texts), diagnostics)
+
+
+def _pages_until(page_texts, deadline):
+    # Repassa as páginas enquanto o prazo da análise não vence; ao desistir, fechar o
+    # gerador de origem cancela a extração paralela pendente (ver cnis/extract.py)
+    for text in page_texts:
+        if time.monotonic() > deadline:
+            raise AnalysisTimeout()
+        yield text
+
+
+def _persist_records(record_store, record_key, pdf_bytes, df, page_count):
+    # Falhar ao gravar os registros (disco cheio, pyarrow ausente) não afeta a análise
+    from cnis.storage import content_digest
+    try:
+        record_store.put(record_key or content_digest(pdf_bytes), df, page_count)
+    except Exception:
+        logger.exception("Erro ao gravar os registros do extrato")
+
+
+# ----------------------------------------------------------------------
+# VÁRIOS EXTRATOS
+# ----------------------------------------------------------------------
+def combine_results(results):
+    # Soma dos resultados de vários extratos (só os bem-sucedidos), no mesmo formato
+    # de um resultado individual. O período vai da competência mais antiga à mais
+    # recente entre os extratos (em ordem cronológica, não alfabética).
+    def chronological(competence):
+        month, year = competence.split("/")
+        return int(year), int(month)
+
+    results = [r for r in results if r["success"]]
+    periods = [r["periodo_analisado"] for r in results if r["total_registros"]]
+    return {
+        "success": bool(results),
+        "total_contribuicoes_a_maior": sum(r["total_contribuicoes_a_maior"] for r in results),
+        "total_registros": sum(r["total_registros"] for r in results),
+        "total_competencias": sum(r["total_competencias"] for r in results),
+        "periodo_analisado": {
+            "inicio": min((p["inicio"] for p in periods), key=chronological) if periods else "N/A",
+            "fim": max((p["fim"] for p in periods), key=chronological) if periods else "N/A",
+        },
+        "total_paginas": sum(r["total_paginas"] for r in results),
+        "detalhamento": _combine_breakdowns([r["detalhamento"] for r in results if r.get("detalhamento") is not None]),
+        "diagnostics": [d for r in results for d in r["diagnostics"]],
+    }
+
+
+def _combine_breakdowns(frames):
+    # Detalhamentos de vários extratos somados por competência e CNPJ (um mesmo CNPJ
+    # pode aparecer em mais de um extrato)
+    if not frames:
+        return None
+    import pandas as pd
+    combined = pd.concat(frames, ignore_index=True).astype({"CNPJ": "category"})
+    return breakdown_frame(combined)
+
+
+def analyze_in_pool(pdf_bytes, today=None, window_years=5, record_store=None, record_key=None, timeout=None,
+                    retry=True):
+    # Uma análise inteira em um processo do pool de cnis/extract.py (com um único
+    # núcleo, aqui mesmo). Bloqueia até o resultado.
+    #
+    # O prazo de `timeout` é conferido pelo próprio worker entre as páginas; se nem
+    # assim o resultado chegar em timeout + POOL_TIMEOUT_MARGIN segundos (worker preso
+    # dentro de uma página), a espera termina com a mesma falha de prazo vencido e o
+    # pool é reciclado, para que o processo preso não continue ocupando um núcleo.
+    # Um pool quebrado (reciclado por outra análise, ou um worker encerrado pelo
+    # sistema) também é descartado, e a análise é refeita uma vez em um pool novo.
+    if EXTRACT_WORKERS <= 1:
+        return analyze_pdf_bytes(pdf_bytes, today, window_years=window_years, record_store=record_store,
+                                 record_key=record_key, timeout=timeout)
+    from concurrent.futures import TimeoutError as FutureTimeout
+    from concurrent.futures.process import BrokenProcessPool
+
+    pool = get_process_pool()
+    future = pool.submit(_analyze_job, bytes(pdf_bytes), today, window_years, record_store, record_key, timeout)
+    try:
+        result, entry = future.result(timeout=None if timeout is None else timeout + POOL_TIMEOUT_MARGIN)
+    except FutureTimeout:
+        recycle_pool(pool)
+        return _timeout_failure(timeout)
+    except BrokenProcessPool:
+        recycle_pool(pool)
+        if not retry:
+            raise
+        return analyze_in_pool(pdf_bytes, today, window_years, record_store, record_key, timeout, retry=False)
+    record_entry(entry)
+    return result
+
+
+def _analyze_job(pdf_bytes, today, window_years, record_store, record_key, timeout=None):
+    # Executado nos processos do pool. As métricas voltam ao processo principal, que
+    # as registra (as janelas de percentis de cada worker não são vistas pelo app).
+    #
+    # A extração é serial (extract_workers=1): um worker não pode repartir páginas com
+    # os outros workers do mesmo pool, e um pool próprio por análise multiplicaria os
+    # processos. O paralelismo fica entre análises: o AnalysisScheduler roda até
+    # EXTRACT_WORKERS análises ao mesmo tempo, uma por núcleo. Um extrato longo que
+    # chega com núcleos ociosos não passa por aqui: o scheduler o analisa com
+    # analyze_pdf_bytes, com a extração em paralelo (ver run_analysis em cnis/scheduler.py).
+    metrics = AnalysisMetrics()
+    metrics.counts["bytes"] = len(pdf_bytes)
+    result = _analyze(pdf_bytes, today, 1, metrics, window_years, record_store, record_key, timeout=timeout)
+    return result, metrics.as_dict(result["success"])
@@ -0,0 +1,254 @@
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# ----------------------------------------------------------------------
+# PROCESSAMENTO EM LOTE (linha de comando)
+# ----------------------------------------------------------------------
+# Analisa um diretório (ou glob) de extratos CNIS em paralelo, fora do Streamlit,
+# gravando uma linha por arquivo à medida que cada análise termina.
+#
+#   python -m cnis.batch extratos/ -o resultados.csv
+#   python -m cnis.batch "lotes/**/*.pdf" -o resultados.jsonl --workers 8
+#   python -m cnis.batch extratos/ -o resultados.parquet
+#   python -m cnis.batch extratos/ -o resultados.csv --records-dir registros/
+#
+# Com --records-dir, os registros de cada extrato também são gravados em Parquet,
+# para reanálises e cenários sem reabrir os PDFs (ver cnis/records.py).
+#
+# Erros em um arquivo (PDF inválido, protegido, sem remunerações) viram uma linha
+# com sucesso = false e não interrompem o lote. Ao final, é exibida a vazão em
+# arquivos/s e páginas/s.
+# ----------------------------------------------------------------------
+
+OUTPUT_FIELDS = [
+    "arquivo",
+    "sucesso",
+    "total_contribuicoes_a_maior",
+    "total_registros",
+    "total_competencias",
+    "periodo_inicio",
+    "periodo_fim",
+    "paginas",
+    "bytes",
+    "segundos",
+    "erros",
+    "avisos",
+]
+
+PARQUET_ROW_GROUP = 256
+
+
+def find_pdfs(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+            matches += glob.glob(os.path.join(item, "**", "*.PDF"), recursive=True)
+        elif glob.has_magic(item):
+            matches = glob.glob(item, recursive=True)
+        else:
+            matches = [item]
+        paths.extend(sorted(matches))
+    # Remove duplicatas preservando a ordem
+    return list(dict.fromkeys(paths))
+
+
+def analyze_file(path, reference_date=None, records_dir=None):
+    # Executado nos processos do pool: nunca levanta exceção, para que um arquivo
+    # problemático vire apenas uma linha de erro no resultado.
+    from cnis.analysis import analyze_pdf_bytes
+    from cnis.records import RecordStore
+
+    started = time.perf_counter()
+    row = dict.fromkeys(OUTPUT_FIELDS)
+    row["arquivo"] = path
+    try:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        row["bytes"] = len(pdf_bytes)
+        # Cada worker do lote já é um processo: a extração do PDF fica serial dentro dele.
+        record_store = RecordStore(records_dir) if records_dir else None
+        result = analyze_pdf_bytes(pdf_bytes, reference_date, extract_workers=1, record_store=record_store)
+    except Exception as e:
+        result = {"success": False, "total_paginas": 0,
+                  "diagnostics": [{"level": "error", "message": f"{type(e).__name__}: {e}"}]}
+
+    row["sucesso"] = bool(result["success"])
+    row["paginas"] = result.get("total_paginas", 0)
+    if result["success"]:
+        row["total_contribuicoes_a_maior"] = round(float(result["total_contribuicoes_a_maior"]), 2)
+        row["total_registros"] = int(result["total_registros"])
+        row["total_competencias"] = int(result["total_competencias"])
+        row["periodo_inicio"] = result["periodo_analisado"]["inicio"]
+        row["periodo_fim"] = result["periodo_analisado"]["fim"]
+    row["erros"] = " | ".join(d["message"] for d in result["diagnostics"] if d["level"] == "error")
+    row["avisos"] = " | ".join(d["message"] for d in result["diagnostics"] if d["level"] != "error")
+    row["segundos"] = round(time.perf_counter() - started, 4)
+    return row
+
+
+# ----------------------------------------------------------------------
+# Gravação incremental dos resultados
+# ----------------------------------------------------------------------
+class CsvWriter:
+    def __init__(self, path):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS)
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, row):
+        self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    # Grava em row groups de PARQUET_ROW_GROUP linhas, sem acumular o lote inteiro em memória
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Erro: a saída Parquet requer a biblioteca 'pyarrow' (pip install pyarrow).")
+        self._pa = pa
+        self._schema = pa.schema([
+            ("arquivo", pa.string()),
+            ("sucesso", pa.bool_()),
+            ("total_contribuicoes_a_maior", pa.float64()),
+            ("total_registros", pa.int64()),
+            ("total_competencias", pa.int64()),
+            ("periodo_inicio", pa.string()),
+            ("periodo_fim", pa.string()),
+            ("paginas", pa.int64()),
+            ("bytes", pa.int64()),
+            ("segundos", pa.float64()),
+            ("erros", pa.string()),
+            ("avisos", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._pending = []
+
+    def write(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= PARQUET_ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(self._pa.Table.from_pylist(self._pending, schema=self._schema))
+            self._pending = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+WRITERS = {".csv": CsvWriter, ".jsonl": JsonlWriter, ".parquet": ParquetWriter}
+
+
+def open_writer(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lower().lstrip(".")
+    writer_cls = WRITERS.get("." + fmt)
+    if writer_cls is None:
+        raise SystemExit(f"Erro: formato de saída não suportado: '{fmt}' (use csv, jsonl ou parquet).")
+    return writer_cls(path)
+
+
+# ----------------------------------------------------------------------
+# Execução do lote
+# ----------------------------------------------------------------------
+def run_batch(paths, writer, workers=None, reference_date=None, progress=None, records_dir=None):
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    totals = {"arquivos": 0, "sucesso": 0, "falhas": 0, "paginas": 0, "bytes": 0}
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(analyze_file, path, reference_date, records_dir): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as e:
+                # Falha do próprio processo (ex.: worker encerrado pelo sistema)
+                row = dict.fromkeys(OUTPUT_FIELDS)
+                row.update(arquivo=futures[future], sucesso=False, paginas=0, erros=f"{type(e).__name__}: {e}", avisos="")
+            writer.write(row)
+
+            totals["arquivos"] += 1
+            totals["sucesso" if row["sucesso"] else "falhas"] += 1
+            totals["paginas"] += row["paginas"] or 0
+            totals["bytes"] += row["bytes"] or 0
+            if progress:
+                progress(row, totals, time.perf_counter() - started)
+
+    elapsed = time.perf_counter() - started
+    totals["segundos"] = elapsed
+    totals["arquivos_por_segundo"] = totals["arquivos"] / elapsed if elapsed else 0.0
+    totals["paginas_por_segundo"] = totals["paginas"] / elapsed if elapsed else 0.0
+    return totals
+
+
+def _print_progress(row, totals, elapsed):
+    status = "ok  " if row["sucesso"] else "ERRO"
+    print(f"[{totals['arquivos']}] {status} {row['arquivo']} ({row['paginas'] or 0} págs, {row['segundos'] or 0:.2f}s)"
+          f"  {totals['arquivos'] / elapsed:.2f} arq/s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cnis.batch", description="Analisa extratos CNIS em lote.")
+    parser.add_argument("inputs", nargs="+", help="diretórios, arquivos PDF ou padrões glob")
+    parser.add_argument("-o", "--output", required=True, help="arquivo de saída (.csv, .jsonl ou .parquet)")
+    parser.add_argument("--format", choices=["csv", "jsonl", "parquet"], help="formato de saída (padrão: pela extensão)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="processos em paralelo (padrão: núcleos da máquina)")
+    parser.add_argument("--reference-date", default=None, help="data de referência da janela de 5 anos (AAAA-MM-DD; padrão: hoje)")
+    parser.add_argument("--records-dir", default=None, help="grava os registros de cada extrato (Parquet) neste diretório")
+    parser.add_argument("-q", "--quiet", action="store_true", help="não exibe o progresso por arquivo")
+    args = parser.parse_args(argv)
+
+    paths = find_pdfs(args.inputs)
+    if not paths:
+        print("Nenhum arquivo PDF encontrado.", file=sys.stderr)
+        return 1
+
+    reference_date = None
+    if args.reference_date:
+        import pandas as pd
+        reference_date = pd.Timestamp(args.reference_date).normalize()
+
+    writer = open_writer(args.output, args.format)
+    try:
+        totals = run_batch(paths, writer, args.workers, reference_date, None if args.quiet else _print_progress,
+                           args.records_dir)
+    finally:
+        writer.close()
+
+    print(f"{totals['arquivos']} arquivos ({totals['sucesso']} ok, {totals['falhas']} com erro), "
+          f"{totals['paginas']} páginas em {totals['segundos']:.2f}s: "
+          f"{totals['arquivos_por_segundo']:.2f} arquivos/s, {totals['paginas_por_segundo']:.1f} páginas/s",
+          file=sys.stderr)
+    return 0 if totals["falhas"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
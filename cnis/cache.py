@@ -0,0 +1,164 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from cnis.diskfiles import evict_files, iter_files, remove_file, write_bytes_atomic
+
+# ----------------------------------------------------------------------
+# CACHE DE RESULTADOS DA ANÁLISE
+# ----------------------------------------------------------------------
+# O resultado da análise depende apenas do conteúdo do PDF, da versão das tabelas
+# do INSS e do mês de referência (que define a janela de 5 anos). A chave do cache
+# combina esses três elementos, de modo que reruns do Streamlit e novos uploads do
+# mesmo extrato reaproveitam o resultado em vez de reabrir e reprocessar o PDF.
+# ----------------------------------------------------------------------
+
+
+def make_cache_key(pdf_bytes, table_version, reference_month, digest=None):
+    # `digest` (SHA-256 em hexadecimal do PDF) evita recalcular o hash quando o chamador já o tem
+    digest = digest or hashlib.sha256(pdf_bytes).hexdigest()
+    return f"{digest}:{table_version}:{reference_month}"
+
+
+class ResultCache:
+    # Cache em dois níveis: LRU em memória (limitado por quantidade de entradas e TTL)
+    # e, opcionalmente, um diretório em disco (limitado por bytes totais e TTL).
+    # Os valores devolvidos são compartilhados entre sessões: trate-os como somente leitura.
+
+    def __init__(self, max_entries=128, ttl_seconds=3600,
+                 disk_dir=None, disk_max_bytes=256 * 1024 * 1024, disk_ttl_seconds=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl_seconds = disk_ttl_seconds
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # chave -> (instante de gravação, valor)
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        self._disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in iter_files(self.disk_dir, ".pkl"))
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._memory_put(key, value, now)
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, value, now)
+        self._disk_put(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.disk_dir:
+                for path, _, _ in iter_files(self.disk_dir, ".pkl"):
+                    remove_file(path)
+                self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._entries)
+            stats["disk_bytes"] = self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    # ------------------------------------------------------------------
+    # Nível em memória (chamado com o lock adquirido)
+    # ------------------------------------------------------------------
+    def _memory_put(self, key, value, now):
+        self._entries[key] = (now, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["memory_evictions"] += 1
+
+    # ------------------------------------------------------------------
+    # Nível em disco
+    # ------------------------------------------------------------------
+    def _disk_path(self, key):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, name[:2], name + ".pkl")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            info = os.stat(path)
+            if now - info.st_mtime > self.disk_ttl_seconds:
+                self._remove(path, info.st_size)
+                return None
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Arquivo corrompido ou de uma versão incompatível: descarta e recalcula.
+            self._remove(path)
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.disk_max_bytes:
+            return
+        try:
+            previous = write_bytes_atomic(self._disk_path(key), data)
+        except OSError:
+            return
+
+        with self._lock:
+            self._disk_bytes += len(data) - previous
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        total, removed = evict_files(self.disk_dir, ".pkl", self.disk_max_bytes, self.disk_ttl_seconds)
+        with self._lock:
+            self._disk_bytes = total
+            self._counters["disk_evictions"] += removed
+
+    def _remove(self, path, size=None):
+        if not remove_file(path):
+            return False
+        if size is not None:
+            with self._lock:
+                self._disk_bytes -= size
+        return True
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+
+# ----------------------------------------------------------------------
+# ARQUIVOS EM DISCO (gravação atômica, listagem e expiração)
+# ----------------------------------------------------------------------
+# Rotinas comuns aos diretórios mantidos pelo app: o nível em disco do cache de
+# resultados (cnis/cache.py), os PDFs enviados (cnis/storage.py) e os registros em
+# Parquet (cnis/records.py). Em todos, cada arquivo fica em um subdiretório com os
+# dois primeiros caracteres do nome, e a gravação é feita em um arquivo temporário
+# renomeado ao final, para que leitores concorrentes (outras sessões ou processos)
+# nunca vejam um arquivo pela metade.
+# ----------------------------------------------------------------------
+
+
+def write_file_atomic(path, write):
+    # `write(tmp_path)` grava o conteúdo em um arquivo temporário no mesmo diretório,
+    # que então substitui `path`. Devolve o tamanho do arquivo substituído (0 se não
+    # existia); em caso de erro, o temporário é removido e o erro, repassado.
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+    return previous
+
+
+def write_bytes_atomic(path, data):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+    return write_file_atomic(path, write)
+
+
+def iter_files(directory, suffix):
+    # (caminho, mtime, tamanho) de cada arquivo com a extensão `suffix`; arquivos
+    # removidos durante a listagem são ignorados
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if not filename.endswith(suffix):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            yield path, info.st_mtime, info.st_size
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def evict_files(directory, suffix, max_bytes, ttl_seconds, keep=None):
+    # Remove os arquivos expirados (mais de ttl_seconds desde a última modificação) e,
+    # se o total ainda exceder max_bytes, os mais antigos, nunca o arquivo `keep`.
+    # Devolve o total de bytes que restou e a quantidade de arquivos removidos.
+    now = time.time()
+    files = sorted(iter_files(directory, suffix), key=lambda item: item[1])
+    total = sum(size for _, _, size in files)
+    removed = 0
+    for path, mtime, size in files:
+        expired = now - mtime > ttl_seconds
+        if not expired and total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        if remove_file(path):
+            total -= size
+            removed += 1
+    return total, removed
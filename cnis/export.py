@@ -0,0 +1,86 @@
+import csv
+import io
+
+from cnis.parser import format_competence
+
+# ----------------------------------------------------------------------
+# EXPORTAÇÃO DO DETALHAMENTO (CSV / XLSX)
+# ----------------------------------------------------------------------
+# O resultado da análise traz em "detalhamento" um DataFrame compacto, uma linha por
+# competência e CNPJ do período analisado (ver breakdown_frame em cnis/analysis.py).
+# A planilha é gerada a partir dele só quando pedida, sem reabrir o PDF nem refazer a
+# análise, formatando CHUNK_ROWS linhas por vez. O arquivo pronto é devolvido em bytes,
+# que é o que o botão de download do Streamlit envia ao navegador.
+#
+#   CSV   separador ";", vírgula decimal e BOM UTF-8 (abre direto no Excel em pt-BR)
+#   XLSX  requer a biblioteca 'openpyxl' (opcional; gravação em modo write_only)
+# ----------------------------------------------------------------------
+
+EXPORT_COLUMNS = ["Competência", "CNPJ", "Remuneração", "Contribuição", "Contribuição a maior"]
+VALUE_COLUMNS = ["Salário", "Contribuição", "Contribuição a maior"]
+
+EXPORT_MIME_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+CHUNK_ROWS = 10_000
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_breakdown_rows(frame, chunk_rows=CHUNK_ROWS):
+    # Lotes de linhas prontas para a planilha: competência "MM/AAAA", CNPJ como texto
+    # e valores arredondados em centavos
+    for start in range(0, len(frame), chunk_rows):
+        chunk = frame.iloc[start:start + chunk_rows]
+        competences = [format_competence(ordinal) for ordinal in chunk["Competência"].tolist()]
+        values = [chunk[column].round(2).tolist() for column in VALUE_COLUMNS]
+        yield list(zip(competences, chunk["CNPJ"].astype(str).tolist(), *values))
+
+
+def iter_breakdown_csv(frame, chunk_rows=CHUNK_ROWS):
+    # O CSV em pedaços de bytes, um por lote de linhas
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    yield "\ufeff".encode("utf-8") + buffer.getvalue().encode("utf-8")
+    for rows in iter_breakdown_rows(frame, chunk_rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((competence, cnpj, *(f"{value:.2f}".replace(".", ",") for value in values))
+                         for competence, cnpj, *values in rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_breakdown_xlsx(frame, f, chunk_rows=CHUNK_ROWS):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportError("A exportação em XLSX requer a biblioteca 'openpyxl' (pip install openpyxl).") from None
+
+    # write_only grava as linhas à medida que são acrescentadas, sem manter a planilha em memória
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Detalhamento")
+    sheet.append(EXPORT_COLUMNS)
+    for rows in iter_breakdown_rows(frame, chunk_rows):
+        for row in rows:
+            sheet.append(row)
+    workbook.save(f)
+
+
+def breakdown_export_bytes(frame, fmt):
+    # O detalhamento no formato pedido, pronto para download
+    if fmt not in EXPORT_MIME_TYPES:
+        raise ValueError(f"Formato de exportação não suportado: '{fmt}' (use csv ou xlsx).")
+    if fmt == "csv":
+        return b"".join(iter_breakdown_csv(frame))
+    f = io.BytesIO()
+    write_breakdown_xlsx(frame, f)
+    return f.getvalue()
@@ -0,0 +1,332 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from cnis.parser import AGRUPAMENTO, BLOCK_MARKER, re_cnpj_bloco
+
+# ----------------------------------------------------------------------
+# EXTRAÇÃO DE TEXTO DO PDF (serial ou paralela)
+# ----------------------------------------------------------------------
+# page.get_text() é a etapa mais cara da análise de extratos longos e roda em um
+# único núcleo. Acima de PARALLEL_MIN_PAGES páginas, o intervalo de páginas é
+# dividido em fatias contíguas, uma por worker de um pool de processos: cada worker
+# abre o documento a partir dos mesmos bytes, extrai a sua fatia, e os textos são
+# devolvidos na ordem das páginas (o parser continua consumindo um fluxo ordenado).
+#
+# Cada tarefa enviada ao pool leva consigo uma cópia serializada do PDF; por isso há
+# uma única fatia por worker (o PDF atravessa o pool uma vez por worker), e não
+# fatias menores, que equilibrariam melhor a carga ao custo de uma cópia a mais para
+# cada uma. As páginas de um extrato CNIS têm custo parecido, e fatias iguais
+# terminam quase juntas.
+#
+# Configuração por variáveis de ambiente:
+#   CNIS_EXTRACT_WORKERS     número de processos (padrão: núcleos da máquina; 1 desliga)
+#   CNIS_PARALLEL_MIN_PAGES  tamanho mínimo, em páginas, para usar o pool (padrão: 64)
+#   CNIS_PRESCAN             "1" liga a extração só da janela (iter_window_page_texts)
+#   CNIS_PRESCAN_MIN_PAGES   tamanho mínimo, em páginas, para tentar a pré-varredura (padrão: 32)
+# ----------------------------------------------------------------------
+
+EXTRACT_WORKERS = int(os.environ.get("CNIS_EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+PARALLEL_MIN_PAGES = int(os.environ.get("CNIS_PARALLEL_MIN_PAGES", "64"))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    # Pool compartilhado pelo processo (criado sob demanda). Usa "spawn" porque o
+    # servidor do Streamlit tem várias threads, e fork com threads ativas não é seguro.
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def get_process_pool():
+    # O mesmo pool, para outras tarefas pesadas do processo (ex.: analyze_in_pool em
+    # cnis/analysis.py), que assim disputam os mesmos EXTRACT_WORKERS núcleos.
+    return _get_pool(EXTRACT_WORKERS)
+
+
+def recycle_pool(pool):
+    # Descarta `pool` encerrando os seus processos à força (ex.: um worker preso em uma
+    # página que não termina e não chega a conferir o prazo); o próximo pedido cria um
+    # pool novo. Tarefas que ainda rodavam nele falham com BrokenProcessPool.
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            _pool_workers = 0
+    # ProcessPoolExecutor não tem (antes do Python 3.14) como encerrar os workers
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _pool_workers = 0
+
+
+def _extract_page_range(pdf_bytes, start, stop):
+    # Executado nos processos do pool
+    return _extract_pages(pdf_bytes, range(start, stop))
+
+
+def _extract_pages(pdf_bytes, pages, scan=False):
+    # Executado nos processos do pool: texto das páginas `pages` (ou, com scan, as
+    # linhas da coluna de competências, ver _column_lines)
+    import fitz
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [_column_lines(doc[i]) if scan else doc[i].get_text() for i in pages]
+    finally:
+        doc.close()
+
+
+def page_slices(page_count, workers):
+    n_chunks = min(page_count, workers)
+    bounds = [page_count * i // n_chunks for i in range(n_chunks + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_page_texts(doc, pdf_bytes=None, workers=None, min_pages=None):
+    # Gera o texto de cada página, em ordem. O modo paralelo exige os bytes do PDF
+    # (cada worker reabre o documento); sem eles, ou abaixo do limite de páginas,
+    # a extração é feita aqui mesmo, página a página.
+    workers = EXTRACT_WORKERS if workers is None else workers
+    min_pages = PARALLEL_MIN_PAGES if min_pages is None else min_pages
+    page_count = len(doc)
+
+    if pdf_bytes is None or workers <= 1 or page_count < max(min_pages, 2):
+        for page in doc:
+            yield page.get_text()
+        return
+
+    # Os workers recebem o PDF serializado; buffers (memoryview, mmap) não são
+    # serializáveis e viram bytes uma única vez aqui.
+    if not isinstance(pdf_bytes, bytes):
+        pdf_bytes = bytes(pdf_bytes)
+    slices = page_slices(page_count, workers)
+    pool = _get_pool(workers)
+    futures = [pool.submit(_extract_page_range, pdf_bytes, start, stop) for start, stop in slices]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        # Se o consumidor abandonar o fluxo (erro no parser, por exemplo), não
+        # deixa fatias pendentes ocupando o pool.
+        for future in futures:
+            future.cancel()
+
+
+# ----------------------------------------------------------------------
+# EXTRAÇÃO SÓ DA JANELA DE ANÁLISE (pré-varredura da coluna de competências)
+# ----------------------------------------------------------------------
+# A análise soma apenas as competências da janela (os últimos 5 anos, por padrão), e
+# nos extratos de quem teve muitos vínculos a maior parte das páginas traz
+# remunerações antigas. iter_window_page_texts lê primeiro só a coluna das
+# competências de cada página (get_text com clip na faixa esquerda) e extrai por
+# inteiro apenas:
+#   - páginas com alguma competência a partir de PRESCAN_MARGIN meses antes do início
+#     da janela, e a página seguinte a cada uma delas (linha de competência cujo
+#     valor ficou na outra página);
+#   - páginas em que nenhuma competência foi reconhecida na coluna;
+#   - para cada página mantida, a última página anterior que abre um vínculo (linha
+#     "Seq.", início da linha de cabeçalho que traz "Código Emp.") e as páginas entre
+#     as duas com qualquer outro texto na coluna além de competências e números
+#     (título de AGRUPAMENTO, "Competência"...). Se nenhuma abertura de vínculo for
+#     reconhecida, todas as páginas com texto desse tipo antes dela são mantidas;
+#   - as páginas seguintes a um cabeçalho de vínculo até aparecer o CNPJ do bloco.
+# O cabeçalho e o rodapé repetidos em todas as páginas (linhas iniciais e finais
+# comuns a todas elas) não contam. Onde páginas foram puladas, o texto seguinte
+# começa com PAGE_GAP, uma linha que impede os padrões do parser de emendar o fim de
+# uma página com o começo de outra que não era a seguinte.
+#
+# As páginas mantidas conferem a leitura da coluna: "Código Emp." só pode aparecer
+# nas que abrem vínculo, e o título de AGRUPAMENTO só nas que têm texto de estrutura.
+# Se algum extrato tiver outro layout e a conferência falhar, ele é extraído por
+# inteiro. Por isso o texto das páginas mantidas é entregue só depois de todas serem
+# extraídas (são poucas, ou a pré-varredura não teria seguido).
+#
+# As competências da janela saem idênticas às da extração completa; ficam de fora
+# registros antigos (e os avisos sobre eles). Por isso o modo não serve para gravar
+# registros (cnis/records.py), que precisam do extrato inteiro. Se nenhuma página
+# mantida tiver competência da janela (todo o histórico é anterior a ela), o extrato
+# também é extraído por inteiro: sem registros, a análise falharia em vez de chegar
+# ao total zero com o aviso de que não há remunerações nos últimos anos.
+#
+# A leitura recortada ainda interpreta o conteúdo da página: custa cerca de 2/3 de
+# um get_text completo, e as páginas mantidas são lidas duas vezes. Só compensa
+# quando a grande maioria das páginas fica de fora; por isso uma amostra (uma página
+# a cada PRESCAN_SAMPLE_STRIDE) decide antes se a pré-varredura segue ou se o
+# extrato é extraído por inteiro, como em iter_page_texts. Em extratos sintéticos de
+# carreiras com vínculos sucessivos (35 a 90 páginas), 70% a 85% das páginas ficam
+# de fora, mas a análise fica só 7% a 11% mais rápida; quando a amostra engana, pode
+# ficar bem mais lenta. Por isso o modo vem desligado (CNIS_PRESCAN), e
+# benchmarks/bench_pipeline.py --prescan mede o efeito em outras máquinas e extratos.
+PRESCAN_PAGES = os.environ.get("CNIS_PRESCAN", "").lower() in ("1", "true", "yes")
+PRESCAN_MIN_PAGES = int(os.environ.get("CNIS_PRESCAN_MIN_PAGES", "32"))
+PRESCAN_SAMPLE_STRIDE = 16
+PRESCAN_MIN_SKIP = 0.75      # fração mínima de páginas antigas na amostra
+PRESCAN_MARGIN = 12          # meses: a coluna esquerda pode não trazer a competência mais recente da linha
+PRESCAN_COLUMN = 0.12        # largura da faixa lida, como fração da largura da página
+BLOCK_START = "Seq."
+PAGE_GAP = "\n[páginas fora da janela de análise]\n"
+
+re_column_competence = re.compile(r"(\d{2})/(\d{4})(?:\s+[\d.,]*)?")
+re_column_number = re.compile(r"[\d.,]+")
+
+
+def _column_lines(page):
+    import fitz
+    rect = page.rect
+    text = page.get_text(clip=fitz.Rect(rect.x0, rect.y0, rect.x0 + rect.width * PRESCAN_COLUMN, rect.y1))
+    return [line for line in (raw.strip() for raw in text.splitlines()) if line]
+
+
+def _page_furniture(column_lines):
+    # Quantas linhas iniciais e finais se repetem em todas as páginas
+    shortest = min(len(lines) for lines in column_lines)
+    head = 0
+    while head < shortest and all(lines[head] == column_lines[0][head] for lines in column_lines):
+        head += 1
+    tail = 0
+    while head + tail < shortest and all(lines[-1 - tail] == column_lines[0][-1 - tail] for lines in column_lines):
+        tail += 1
+    return head, tail
+
+
+def _classify_page(lines, furniture):
+    # (competência mais recente da coluna, ou -1 se nenhuma for reconhecida; se há
+    # outro texto além de competências e números; se a página abre um vínculo)
+    head, tail = furniture
+    newest, structural, opens_block = -1, False, False
+    for line in lines[head:len(lines) - tail]:
+        m = re_column_competence.fullmatch(line)
+        if m:
+            month, year = int(m[1]), int(m[2])
+            newest = max(newest, year * 12 + month - 1 if 1 <= month <= 12 else 0)
+        elif not re_column_number.fullmatch(line):
+            structural = True
+            opens_block = opens_block or line == BLOCK_START
+    return newest, structural, opens_block
+
+
+def plan_window_pages(pages, cutoff):
+    # Páginas a extrair por inteiro (lista de bool), a partir da classificação de cada
+    # página (_classify_page) e do mês ordinal de início da janela
+    low = cutoff - PRESCAN_MARGIN
+    needed = [newest < 0 or newest >= low or (i > 0 and pages[i - 1][0] >= low)
+              for i, (newest, _, _) in enumerate(pages)]
+
+    # De trás para a frente: cada página necessária puxa as páginas com texto de
+    # estrutura anteriores, até a que abre o vínculo
+    keep = list(needed)
+    pulling = False
+    for i in range(len(pages) - 1, -1, -1):
+        _, structural, opens_block = pages[i]
+        if pulling and structural:
+            keep[i] = True
+            pulling = not opens_block
+        if needed[i]:
+            pulling = True
+    return keep
+
+
+def _map_pages(doc, pdf_bytes, workers, min_pages, pages, scan=False):
+    # Texto (ou linhas da coluna, com scan) das páginas `pages`, em ordem; no pool de
+    # processos quando há bytes, workers e páginas suficientes, como em iter_page_texts
+    if pdf_bytes is None or workers <= 1 or len(pages) < max(min_pages, 2):
+        for i in pages:
+            yield _column_lines(doc[i]) if scan else doc[i].get_text()
+        return
+    pool = _get_pool(workers)
+    futures = [pool.submit(_extract_pages, pdf_bytes, pages[start:stop], scan)
+               for start, stop in page_slices(len(pages), workers)]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def iter_window_page_texts(doc, cutoff, pdf_bytes=None, workers=None, min_pages=None, counts=None):
+    # Como iter_page_texts, mas só com as páginas que podem ter competências a partir
+    # do mês ordinal `cutoff` (ver o comentário acima). Em `counts`, se informado,
+    # "pages_skipped" recebe quantas páginas não foram extraídas.
+    workers = EXTRACT_WORKERS if workers is None else workers
+    min_pages = PARALLEL_MIN_PAGES if min_pages is None else min_pages
+    page_count = len(doc)
+
+    if page_count < max(PRESCAN_MIN_PAGES, 2 * PRESCAN_SAMPLE_STRIDE):
+        yield from iter_page_texts(doc, pdf_bytes, workers, min_pages)
+        return
+    if pdf_bytes is not None and not isinstance(pdf_bytes, bytes):
+        pdf_bytes = bytes(pdf_bytes)
+
+    # Amostra: se poucas páginas ficariam de fora, a pré-varredura não compensa
+    # (estimativa otimista: ignora os cabeçalhos que as páginas da janela puxam)
+    sample = {i: _column_lines(doc[i]) for i in range(0, page_count, PRESCAN_SAMPLE_STRIDE)}
+    furniture = _page_furniture(list(sample.values()))
+    skippable = sum(0 <= _classify_page(lines, furniture)[0] < cutoff - PRESCAN_MARGIN for lines in sample.values())
+    if skippable < PRESCAN_MIN_SKIP * len(sample):
+        yield from iter_page_texts(doc, pdf_bytes, workers, min_pages)
+        return
+
+    rest = [i for i in range(page_count) if i not in sample]
+    sample.update(zip(rest, _map_pages(doc, pdf_bytes, workers, min_pages, rest, scan=True)))
+    column_lines = [sample[i] for i in range(page_count)]
+    furniture = _page_furniture(column_lines)
+    classes = [_classify_page(lines, furniture) for lines in column_lines]
+    keep = plan_window_pages(classes, cutoff)
+    if not any(keep[i] and classes[i][0] >= cutoff - PRESCAN_MARGIN for i in range(page_count)):
+        yield from iter_page_texts(doc, pdf_bytes, workers, min_pages)
+        return
+    pages = [i for i in range(page_count) if keep[i]]
+
+    # Bloco aberto ainda sem CNPJ (inclusive o trecho antes do primeiro cabeçalho): as
+    # páginas seguintes são extraídas até ele aparecer, mesmo que fossem puladas
+    pending_cnpj = True
+    previous = -1
+    texts = []
+
+    def follow(i, text):
+        nonlocal pending_cnpj
+        segments = text.split(BLOCK_MARKER)
+        if len(segments) > 1 or pending_cnpj:
+            pending_cnpj = re_cnpj_bloco.search(segments[-1]) is None
+        _, structural, opens_block = classes[i]
+        return (len(segments) > 1) == opens_block and (structural or AGRUPAMENTO not in text)
+
+    for i, text in zip(pages, _map_pages(doc, pdf_bytes, workers, min_pages, pages)):
+        while pending_cnpj and previous + 1 < i:
+            previous += 1
+            extra = doc[previous].get_text()
+            if not follow(previous, extra):
+                break
+            texts.append(extra)
+        else:
+            if follow(i, text):
+                texts.append(text if previous + 1 == i else PAGE_GAP + text)
+                previous = i
+                continue
+        # Layout diferente do esperado pela leitura da coluna
+        yield from iter_page_texts(doc, pdf_bytes, workers, min_pages)
+        return
+
+    if counts is not None:
+        counts["pages_skipped"] = page_count - len(texts)
+    yield from texts
@@ -0,0 +1,241 @@
+import bisect
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+# TABELAS INSS - Alíquotas e Tetos por período
+# ----------------------------------------------------------------------
+# As tabelas ficam em um arquivo de dados versionado (cnis/data/inss_tables.json),
+# com histórico desde 07/1994. Na inicialização o arquivo é compilado uma única vez
+# em um índice imutável; calculate_inss, calculate_inss_batch e get_inss_ceiling
+# apenas consultam esse índice (busca binária pelo mês de início de vigência).
+#
+# Até 02/2020 (antes da EC 103/2019) as tabelas não eram progressivas: uma única
+# alíquota, a da faixa em que o salário se enquadra, incidia sobre todo o salário
+# (limitado ao teto). Essas tabelas trazem "progressive": false no arquivo de dados.
+INSS_TABLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "inss_tables.json")
+
+InssTableIndex = namedtuple("InssTableIndex", [
+    "version",                 # versão declarada no arquivo + hash do conteúdo
+    "keys",                    # chaves "AAAA-MM" em ordem crescente de vigência
+    "starts",                  # início de vigência de cada tabela (ano * 12 + mês - 1)
+    "ranges",                  # por tabela: ((largura da faixa, alíquota), ...)
+    "limits",                  # por tabela: limite superior de cada faixa
+    "progressive",             # por tabela: alíquotas por faixa (True) ou alíquota única (False)
+    "ceilings",                # teto de cada tabela
+    "max_contributions",       # contribuição máxima (sobre o teto) de cada tabela
+    "start_array",             # os mesmos dados em arrays NumPy somente leitura,
+    "ceiling_array",           # usados pelo cálculo vetorizado
+    "max_contribution_array",
+    "flat_array",              # tabelas de alíquota única
+    "widths",                  # (tabelas x faixas); faixas ausentes têm largura e alíquota zero
+    "aliquots",
+    "limit_array",             # (tabelas x faixas); faixas ausentes têm limite infinito
+    "last_range_array",        # posição da última faixa de cada tabela
+])
+
+
+def load_inss_tables(path=INSS_TABLES_FILE):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data["version"], data["tables"]
+
+
+def competence_ordinal(year, month):
+    return year * 12 + month - 1
+
+
+def _progressive_contribution(salary, ranges):
+    # Cálculo progressivo: a contribuição incide sobre a parte do salário que cai em cada faixa.
+    # Exemplo: Salário 2000, Faixa 1 (0-1412, 7.5%), Faixa 2 (1412.01-2666.68, 9%)
+    # Na Faixa 1: contribui sobre 1412 * 0.075
+    # Na Faixa 2: contribui sobre (2000 - 1412) * 0.09
+    contribution = 0.0
+    remaining_salary = salary
+    for width, aliquot in ranges:
+        if remaining_salary <= 0:
+            break
+        portion_in_range = min(remaining_salary, width)
+        # Garante que a porção não seja negativa
+        if portion_in_range < 0:
+            portion_in_range = 0
+        contribution += portion_in_range * aliquot
+        remaining_salary -= portion_in_range
+    return contribution
+
+
+def _flat_contribution(salary, ranges, limits):
+    # Alíquota única: a da faixa em que o salário se enquadra (a primeira cujo limite
+    # superior ele não ultrapassa) incide sobre todo o salário.
+    # Exemplo: Salário 2000 em 01/2015, Faixa 2 (1399.13-2331.88, 9%): 2000 * 0.09
+    for limit, (_, aliquot) in zip(limits, ranges):
+        if salary <= limit:
+            return salary * aliquot
+    return salary * ranges[-1][1]
+
+
+def _table_contribution(salary, ranges, limits, progressive):
+    if progressive:
+        return _progressive_contribution(salary, ranges)
+    return _flat_contribution(salary, ranges, limits)
+
+
+def _readonly_array(values, dtype):
+    array = np.array(values, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+
+def compile_inss_index(version, tables):
+    keys = sorted(tables, key=lambda key: competence_ordinal(*(int(part) for part in key.split("-"))))
+    starts = []
+    ranges = []
+    limits = []
+    progressive = []
+    ceilings = []
+    max_contributions = []
+    for key in keys:
+        table_year, table_month = (int(part) for part in key.split("-"))
+        table = tables[key]
+        # Largura de cada faixa: r["max"] - r["min"] + 0.01 para incluir o limite superior
+        table_ranges = tuple((r["max"] - r["min"] + 0.01, r["aliquot"]) for r in table["ranges"])
+        table_limits = tuple(float(r["max"]) for r in table["ranges"])
+        table_progressive = table.get("progressive", True)
+        starts.append(competence_ordinal(table_year, table_month))
+        ranges.append(table_ranges)
+        limits.append(table_limits)
+        progressive.append(table_progressive)
+        ceilings.append(float(table["ceiling"]))
+        # Sobre o teto: nas tabelas de alíquota única, a maior alíquota x teto
+        max_contributions.append(_table_contribution(float(table["ceiling"]), table_ranges, table_limits, table_progressive))
+
+    n_ranges = max(len(table_ranges) for table_ranges in ranges)
+    widths = np.zeros((len(keys), n_ranges))
+    aliquots = np.zeros((len(keys), n_ranges))
+    limit_array = np.full((len(keys), n_ranges), np.inf)
+    for i, (table_ranges, table_limits) in enumerate(zip(ranges, limits)):
+        for j, (width, aliquot) in enumerate(table_ranges):
+            widths[i, j] = width
+            aliquots[i, j] = aliquot
+            limit_array[i, j] = table_limits[j]
+    widths.setflags(write=False)
+    aliquots.setflags(write=False)
+    limit_array.setflags(write=False)
+
+    digest = hashlib.sha256(json.dumps(tables, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return InssTableIndex(
+        version=f"{version}+{digest}",
+        keys=tuple(keys),
+        starts=tuple(starts),
+        ranges=tuple(ranges),
+        limits=tuple(limits),
+        progressive=tuple(progressive),
+        ceilings=tuple(ceilings),
+        max_contributions=tuple(max_contributions),
+        start_array=_readonly_array(starts, np.int64),
+        ceiling_array=_readonly_array(ceilings, np.float64),
+        max_contribution_array=_readonly_array(max_contributions, np.float64),
+        flat_array=_readonly_array([not p for p in progressive], np.bool_),
+        widths=widths,
+        aliquots=aliquots,
+        limit_array=limit_array,
+        last_range_array=_readonly_array([len(r) - 1 for r in ranges], np.int64),
+    )
+
+
+_INSS_VERSION, INSS_TABLES = load_inss_tables()
+INSS_INDEX = compile_inss_index(_INSS_VERSION, INSS_TABLES)
+
+# Identifica a versão e o conteúdo das tabelas; entra na chave do cache de resultados
+# para que uma alteração nas tabelas invalide automaticamente as análises anteriores.
+INSS_TABLES_VERSION = INSS_INDEX.version
+
+
+def _table_position(competence_dt):
+    # Posição da tabela vigente na competência (a de início mais recente não posterior a ela),
+    # ou -1 se a competência for anterior à primeira tabela.
+    return bisect.bisect_right(INSS_INDEX.starts, competence_ordinal(competence_dt.year, competence_dt.month)) - 1
+
+
+def calculate_inss(salary, competence_dt):
+    i = _table_position(competence_dt)
+    if i < 0:
+        # Se nenhuma tabela for encontrada (ex: data muito antiga), retorna 0
+        return 0.0
+
+    # Aplica o teto do INSS antes de calcular a contribuição (progressiva ou de alíquota
+    # única) e limita o resultado à contribuição máxima sobre o teto (pré-calculada no índice).
+    contribution = _table_contribution(min(salary, INSS_INDEX.ceilings[i]), INSS_INDEX.ranges[i],
+                                       INSS_INDEX.limits[i], INSS_INDEX.progressive[i])
+    return min(contribution, INSS_INDEX.max_contributions[i])
+
+
+def competence_ordinals(competences):
+    # Meses ordinais (ano * 12 + mês - 1) de um array de competências: inteiros já são
+    # meses ordinais (como os do parser); datas (datetime64) são convertidas.
+    competences = np.asarray(competences)
+    if np.issubdtype(competences.dtype, np.integer):
+        return competences.astype(np.int64)
+    return competences.astype("datetime64[M]").astype(np.int64) + 1970 * 12
+
+
+def _table_positions(competences):
+    # Versão vetorizada de _table_position. Devolve a posição da tabela de cada
+    # competência (mês ordinal ou datetime64) e a máscara das que têm tabela; as
+    # demais recebem a posição 0 e devem ser descartadas pelo chamador.
+    ordinals = competence_ordinals(competences)
+    table_idx = np.searchsorted(INSS_INDEX.start_array, ordinals, side="right") - 1
+    has_table = table_idx >= 0
+    return np.where(has_table, table_idx, 0), has_table
+
+
+def calculate_inss_batch(salaries, competences):
+    # Versão vetorizada de calculate_inss: recebe arrays de salários e de competências
+    # (meses ordinais ou datetime64) e devolve a contribuição de cada linha. As operações de ponto
+    # flutuante seguem exatamente a mesma ordem do cálculo escalar (faixa a faixa),
+    # de modo que os resultados são idênticos aos de calculate_inss.
+    salaries = np.asarray(salaries, dtype=np.float64)
+    table_idx, has_table = _table_positions(competences)
+
+    base = np.minimum(salaries, INSS_INDEX.ceiling_array[table_idx])
+    remaining = base.copy()
+    contribution = np.zeros(len(salaries))
+    widths = INSS_INDEX.widths[table_idx]
+    aliquots = INSS_INDEX.aliquots[table_idx]
+
+    for j in range(widths.shape[1]):
+        portion = np.where(remaining <= 0, 0.0, np.minimum(remaining, widths[:, j]))
+        portion = np.where(portion < 0, 0.0, portion)
+        contribution += portion * aliquots[:, j]
+        remaining -= portion
+
+    # Tabelas de alíquota única: a alíquota da faixa do salário (a primeira cujo limite
+    # ele não ultrapassa, no máximo a última faixa da tabela) sobre todo o salário
+    flat = INSS_INDEX.flat_array[table_idx]
+    if flat.any():
+        bracket = (base[:, None] > INSS_INDEX.limit_array[table_idx]).sum(axis=1)
+        bracket = np.minimum(bracket, INSS_INDEX.last_range_array[table_idx])
+        flat_contribution = base * aliquots[np.arange(len(base)), bracket]
+        contribution = np.where(flat, flat_contribution, contribution)
+
+    contribution = np.minimum(contribution, INSS_INDEX.max_contribution_array[table_idx])
+    # Competências anteriores à primeira tabela não têm contribuição calculada
+    return np.where(has_table, contribution, 0.0)
+
+
+def get_inss_ceiling(competence_dt):
+    i = _table_position(competence_dt)
+    if i < 0:
+        return 0.0
+    return INSS_INDEX.ceilings[i]
+
+
+def get_max_contribution_batch(competences):
+    # Contribuição máxima (sobre o teto) vigente em cada competência, lida do índice:
+    # equivale a calculate_inss(get_inss_ceiling(dt), dt), sem recalcular as faixas.
+    table_idx, has_table = _table_positions(competences)
+    return np.where(has_table, INSS_INDEX.max_contribution_array[table_idx], 0.0)
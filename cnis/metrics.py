@@ -0,0 +1,227 @@
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+# ----------------------------------------------------------------------
+# MÉTRICAS DA ANÁLISE (tempo, CPU e memória por etapa)
+# ----------------------------------------------------------------------
+# Cada chamada de analyze_pdf_bytes registra, para as etapas open, extract, parse,
+# contrib, persist (só quando os registros são gravados) e aggregation: tempo de
+# relógio, tempo de CPU da thread, a variação da memória residente do processo (RSS)
+# e, opcionalmente, o pico de memória alocada pelo Python; além de páginas extraídas
+# e puladas (fora da janela), caracteres de texto e registros.
+# Ao final, as medidas viram uma linha de log estruturada (JSON) no logger
+# "cnis.metrics" e alimentam janelas deslizantes no processo, das quais saem os
+# percentis exibidos no painel de diagnóstico do app.
+#
+# O custo é de duas leituras de relógio por etapa e por página, mais duas leituras
+# do RSS por etapa (/proc/self/statm no Linux; em outros sistemas, o RSS máximo de
+# getrusage, e a variação passa a ser só o quanto o pico cresceu), o suficiente para
+# ficar sempre ligado. Configuração por variáveis de ambiente:
+#   CNIS_METRICS_WINDOW       análises mantidas para os percentis (padrão: 500)
+#   CNIS_METRICS_TRACEMALLOC  "1" mede também o pico de memória alocada pelo Python
+#                             com tracemalloc (mais detalhado que o RSS, mas de custo
+#                             alto: deixa as alocações do Python ~2x mais lentas)
+#   CNIS_METRICS_LOG          "1" imprime as linhas de log em stderr, se a aplicação
+#                             não tiver configurado o logging
+#
+# Observações: o tempo de CPU é o da thread da análise (cada sessão do Streamlit roda
+# em uma thread), sem o dos processos de extração paralela; e o RSS e o tracemalloc
+# são do processo inteiro, então análises simultâneas somam suas variações e picos
+# (o RSS também inclui a memória do MuPDF, fora do alcance do tracemalloc).
+# ----------------------------------------------------------------------
+
+STAGES = ("open", "extract", "parse", "contrib", "persist", "aggregation")
+PERCENTILES = (50, 90, 99)
+
+METRICS_WINDOW = int(os.environ.get("CNIS_METRICS_WINDOW", "500"))
+TRACE_MEMORY = os.environ.get("CNIS_METRICS_TRACEMALLOC", "").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("cnis.metrics")
+if os.environ.get("CNIS_METRICS_LOG", "").lower() in ("1", "true", "yes") and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+if TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes():
+    # Memória residente do processo, em bytes (None se não houver como medir)
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é em KiB no Linux e em bytes no macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class AnalysisMetrics:
+    # Medidas de uma única análise. As etapas podem ser aninhadas (a extração acontece
+    # dentro do parsing, que consome as páginas sob demanda): o tempo de uma etapa
+    # interna é descontado da etapa que a envolve, e cada etapa fica com o tempo exclusivo.
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {"bytes": 0, "pages": 0, "pages_skipped": 0, "text_chars": 0, "records": 0}
+        self._stack = []
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self._rss_started = _rss_bytes()
+
+    def _add(self, name, wall, cpu, memory_peak=None, rss_delta=None):
+        stage = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+        stage["wall_seconds"] += wall
+        stage["cpu_seconds"] += cpu
+        if memory_peak is not None:
+            stage["memory_peak_bytes"] = max(stage.get("memory_peak_bytes", 0), memory_peak)
+        if rss_delta is not None:
+            stage["rss_delta_bytes"] = stage.get("rss_delta_bytes", 0) + rss_delta
+        if self._stack:
+            outer = self.stages.setdefault(self._stack[-1], {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+            outer["wall_seconds"] -= wall
+            outer["cpu_seconds"] -= cpu
+            if rss_delta is not None:
+                outer["rss_delta_bytes"] = outer.get("rss_delta_bytes", 0) - rss_delta
+
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        rss_start = _rss_bytes()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        self._stack.append(name)
+        try:
+            yield self
+        finally:
+            self._stack.pop()
+            wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            memory_peak = tracemalloc.get_traced_memory()[1] - memory_start if tracing else None
+            rss_end = _rss_bytes() if rss_start is not None else None
+            self._add(name, wall, cpu, memory_peak, None if rss_end is None else rss_end - rss_start)
+
+    def timed_pages(self, page_texts, stage="extract"):
+        # Repassa o texto das páginas, contando o tempo gasto para obter cada uma
+        # como da etapa `stage`, e não da etapa que as consome (a memória, medida só
+        # por etapa, continua na que as consome).
+        iterator = iter(page_texts)
+        while True:
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            try:
+                text = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._add(stage, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+            self.counts["pages"] += 1
+            self.counts["text_chars"] += len(text)
+            yield text
+
+    def as_dict(self, success=None):
+        rss = _rss_bytes() if self._rss_started is not None else None
+        return {
+            "success": success,
+            "wall_seconds": time.perf_counter() - self._started,
+            "cpu_seconds": time.thread_time() - self._cpu_started,
+            "rss_bytes": rss,
+            "rss_delta_bytes": None if rss is None else rss - self._rss_started,
+            "stages": {name: dict(values) for name, values in self.stages.items()},
+            **self.counts,
+        }
+
+
+class MetricsRegistry:
+    # Janelas deslizantes (deque com tamanho máximo) das últimas análises do processo,
+    # compartilhadas entre sessões; os percentis são calculados só quando pedidos.
+    # Há janelas para o tempo de relógio e para a variação do RSS de cada etapa.
+
+    def __init__(self, window=METRICS_WINDOW, recent=20):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = {}
+        self._memory = {}
+        self._recent = deque(maxlen=recent)
+        self._totals = {"analyses": 0, "failures": 0}
+
+    def record(self, entry):
+        with self._lock:
+            self._totals["analyses"] += 1
+            if entry.get("success") is False:
+                self._totals["failures"] += 1
+            self._sample(self._samples, "total", entry["wall_seconds"])
+            if entry.get("rss_delta_bytes") is not None:
+                self._sample(self._memory, "total", entry["rss_delta_bytes"])
+            for name, values in entry["stages"].items():
+                self._sample(self._samples, name, values["wall_seconds"])
+                if "rss_delta_bytes" in values:
+                    self._sample(self._memory, name, values["rss_delta_bytes"])
+            self._recent.append(entry)
+
+    def _sample(self, windows, name, value):
+        samples = windows.get(name)
+        if samples is None:
+            samples = windows[name] = deque(maxlen=self._window)
+        samples.append(value)
+
+    def percentiles(self, percentiles=PERCENTILES, memory=False):
+        # Tempo de relógio por etapa (em segundos) ou, com `memory`, variação do RSS
+        # (em bytes): quantidade de amostras, percentis pelo método do posto mais
+        # próximo e máximo da janela.
+        with self._lock:
+            windows = self._memory if memory else self._samples
+            snapshot = {name: sorted(samples) for name, samples in windows.items()}
+        report = {}
+        for name in (*STAGES, "total"):
+            values = snapshot.get(name)
+            if not values:
+                continue
+            row = {"count": len(values)}
+            for p in percentiles:
+                row[f"p{p}"] = values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+            row["max"] = values[-1]
+            report[name] = row
+        return report
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def record_analysis(metrics, success, registry=REGISTRY):
+    # Fecha as medidas de uma análise: linha de log estruturada + janelas do processo
+    return record_entry(metrics.as_dict(success), registry)
+
+
+def record_entry(entry, registry=REGISTRY):
+    # Registra medidas já fechadas (AnalysisMetrics.as_dict), por exemplo as de uma
+    # análise feita em outro processo
+    registry.record(entry)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": "cnis.analysis", **entry}, ensure_ascii=False))
+    return entry
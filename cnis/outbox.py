@@ -0,0 +1,341 @@
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+# ----------------------------------------------------------------------
+# FILA DE SAÍDA DOS LEADS (outbox em SQLite + worker em segundo plano)
+# ----------------------------------------------------------------------
+# O envio do formulário de contato apenas grava o lead em uma tabela SQLite local
+# (uma inserção, sem rede): a resposta ao usuário não depende da latência nem da
+# disponibilidade do CRM. Uma thread em segundo plano drena a fila:
+#   - envia os leads pendentes em lotes (POST JSON para o webhook);
+#   - em caso de falha, tenta de novo com espera exponencial (com variação
+#     aleatória) até max_attempts; erros permanentes (4xx) não são repetidos;
+#   - cada lead tem uma chave de idempotência, enviada junto, para que o destino
+#     descarte duplicatas (reenvio após timeout, dois processos do app, duplo clique);
+#   - os PDFs dos extratos podem seguir como anexos, lidos do armazenamento em disco
+#     (cnis/storage.py) pelas chaves guardadas no lead, só no momento do envio.
+#
+# O banco usa WAL: leitores e o worker não bloqueiam quem insere, e um lead gravado
+# sobrevive a uma queda do app (synchronous=NORMAL: só uma queda do sistema
+# operacional pode perder as últimas transações).
+#
+#   python -m cnis.outbox status --db leads.sqlite3
+#   python -m cnis.outbox serve --port 8765 --fail-rate 0.3 --delay 2
+#
+# "serve" é um endpoint local de teste, que faz o papel do CRM: aceita os lotes,
+# descarta duplicatas pela chave de idempotência e pode simular lentidão e falhas.
+# ----------------------------------------------------------------------
+
+PENDING, SENT, DEAD = "pending", "sent", "dead"
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key  TEXT NOT NULL UNIQUE,
+    payload          TEXT NOT NULL,
+    attachment_key   TEXT,
+    status           TEXT NOT NULL DEFAULT 'pending',
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at  REAL NOT NULL,
+    created_at       REAL NOT NULL,
+    sent_at          REAL,
+    last_error       TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+class DeliveryError(Exception):
+    # permanent=True: o destino recusou o conteúdo (não adianta repetir)
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def lead_idempotency_key(*parts):
+    # Chave determinística a partir dos dados que identificam o lead: reenviar o mesmo
+    # formulário (duplo clique, rerun) não cria um segundo lead.
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def post_json(url, body, headers, timeout):
+    data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(url, data=data, method="POST",
+                                     headers={"Content-Type": "application/json", **headers})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        # 408 (timeout) e 429 (limite de requisições) são temporários, assim como os 5xx
+        permanent = 400 <= e.code < 500 and e.code not in (408, 429)
+        raise DeliveryError(f"HTTP {e.code}: {e.reason}", permanent=permanent) from None
+    except (urllib.error.URLError, OSError) as e:
+        raise DeliveryError(f"{type(e).__name__}: {e}") from None
+
+
+class LeadOutbox:
+    def __init__(self, db_path, webhook_url=None, upload_store=None, attach_pdf=False,
+                 batch_size=20, max_attempts=10, base_backoff=2.0, max_backoff=900.0,
+                 timeout=10.0, poll_interval=5.0, sender=post_json):
+        self.db_path = db_path
+        self.webhook_url = webhook_url
+        self.upload_store = upload_store
+        self.attach_pdf = attach_pdf
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.sender = sender
+
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    # ------------------------------------------------------------------
+    # Conexões (uma por thread: o sqlite3 não compartilha conexões entre threads)
+    # ------------------------------------------------------------------
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def enqueue(self, payload, attachment_keys=(), idempotency_key=None):
+        # Grava o lead e acorda o worker. `attachment_keys`: chaves dos PDFs no
+        # armazenamento de uploads. Devolve a chave de idempotência; se já existir um
+        # lead com a mesma chave, nada é gravado.
+        key = idempotency_key or uuid.uuid4().hex
+        attachment_key = " ".join(attachment_keys) or None
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR IGNORE INTO outbox (idempotency_key, payload, attachment_key, next_attempt_at, created_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(payload, ensure_ascii=False), attachment_key, now, now),
+        )
+        self._wakeup.set()
+        return key
+
+    def start(self):
+        # Sem webhook configurado, os leads apenas se acumulam na fila (nada se perde)
+        if self._thread is not None or not self.webhook_url:
+            return self
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="cnis-lead-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        stats = {PENDING: 0, SENT: 0, DEAD: 0}
+        stats.update(dict(rows))
+        oldest = self._connection().execute(
+            "SELECT MIN(created_at) FROM outbox WHERE status = ?", (PENDING,)).fetchone()[0]
+        stats["oldest_pending_seconds"] = time.time() - oldest if oldest else 0.0
+        return stats
+
+    def drain(self):
+        # Envia tudo o que estiver vencido, lote a lote. Devolve quantos leads foram
+        # entregues. Usado pelo worker; pode ser chamado diretamente (testes, CLI).
+        delivered = 0
+        while not self._stopping.is_set():
+            rows = self._claim_due()
+            if not rows:
+                break
+            delivered += self._deliver(rows)
+        return delivered
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.drain()
+            except Exception:
+                # Erro inesperado (banco bloqueado, disco cheio): tenta de novo no próximo ciclo
+                logger.exception("Erro ao drenar a fila de leads")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim_due(self):
+        # Reserva um lote de leads vencidos, adiando o próximo envio deles para depois
+        # do timeout: outro worker (outro processo do app) não pega os mesmos leads.
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, idempotency_key, payload, attachment_key, attempts FROM outbox"
+                " WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (PENDING, now, self.batch_size),
+            ).fetchall()
+            if rows:
+                conn.executemany("UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                                 [(now + 2 * self.timeout, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _lead_body(self, row):
+        _, key, payload, attachment_key, _ = row
+        lead = {"idempotency_key": key, "payload": json.loads(payload), "attachments": []}
+        for pdf_key in (attachment_key or "").split():
+            attachment = {"sha256": pdf_key}
+            if self.upload_store is not None:
+                attachment["size"] = self.upload_store.size(pdf_key)
+                if self.attach_pdf:
+                    try:
+                        attachment["content_base64"] = base64.b64encode(self.upload_store.read(pdf_key)).decode("ascii")
+                    except KeyError:
+                        # PDF já removido do armazenamento: o lead segue com a referência
+                        attachment["missing"] = True
+            lead["attachments"].append(attachment)
+        return lead
+
+    def _deliver(self, rows):
+        body = {"leads": [self._lead_body(row) for row in rows]}
+        batch_key = lead_idempotency_key(*(row[1] for row in rows))
+        try:
+            self.sender(self.webhook_url, body, {"Idempotency-Key": batch_key}, self.timeout)
+        except DeliveryError as e:
+            if e.permanent and len(rows) > 1:
+                # Um lead recusado não deve derrubar o lote inteiro: reenvia um a um
+                return sum(self._deliver([row]) for row in rows)
+            self._mark_failed(rows, str(e), e.permanent)
+            return 0
+        except Exception as e:
+            self._mark_failed(rows, f"{type(e).__name__}: {e}", False)
+            return 0
+        now = time.time()
+        self._connection().executemany(
+            "UPDATE outbox SET status = ?, sent_at = ?, attempts = attempts + 1, last_error = NULL WHERE id = ?",
+            [(SENT, now, row[0]) for row in rows],
+        )
+        return len(rows)
+
+    def _backoff(self, attempts):
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _mark_failed(self, rows, error, permanent):
+        now = time.time()
+        updates = []
+        for row_id, _, _, _, attempts in rows:
+            attempts += 1
+            status = DEAD if permanent or attempts >= self.max_attempts else PENDING
+            updates.append((status, attempts, now + self._backoff(attempts), error, row_id))
+        self._connection().executemany(
+            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?", updates)
+
+
+# ----------------------------------------------------------------------
+# Linha de comando: situação da fila e endpoint local de teste
+# ----------------------------------------------------------------------
+def serve(host="127.0.0.1", port=8765, fail_rate=0.0, delay=0.0):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    seen = set()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if delay:
+                time.sleep(delay)
+            if random.random() < fail_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            leads = body.get("leads", [])
+            with lock:
+                new = [lead for lead in leads if lead["idempotency_key"] not in seen]
+                seen.update(lead["idempotency_key"] for lead in new)
+            for lead in new:
+                print(f"lead recebido: {lead['idempotency_key'][:12]} {json.dumps(lead['payload'], ensure_ascii=False)}"
+                      f" + {len(lead.get('attachments', []))} anexo(s)", file=sys.stderr)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({"accepted": len(new), "duplicates": len(leads) - len(new)}).encode("utf-8"))
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"endpoint de teste em http://{host}:{server.server_port}/ (falhas: {fail_rate:.0%}, atraso: {delay}s)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cnis.outbox", description="Fila de saída dos leads.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    status = commands.add_parser("status", help="mostra a situação da fila")
+    status.add_argument("--db", required=True, help="arquivo SQLite da fila")
+
+    drain = commands.add_parser("drain", help="envia agora os leads vencidos")
+    drain.add_argument("--db", required=True, help="arquivo SQLite da fila")
+    drain.add_argument("--url", required=True, help="URL do webhook")
+
+    server = commands.add_parser("serve", help="endpoint local que faz o papel do CRM, para testes")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8765)
+    server.add_argument("--fail-rate", type=float, default=0.0, help="fração de requisições respondidas com 503")
+    server.add_argument("--delay", type=float, default=0.0, help="atraso por requisição, em segundos")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.fail_rate, args.delay)
+    elif args.command == "status":
+        print(json.dumps(LeadOutbox(args.db).stats(), indent=2))
+    else:
+        delivered = LeadOutbox(args.db, webhook_url=args.url).drain()
+        print(f"{delivered} leads entregues", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
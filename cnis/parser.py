@@ -0,0 +1,186 @@
+import re
+from array import array
+
+# ----------------------------------------------------------------------
+# PARSER DO EXTRATO CNIS (streaming, página a página)
+# ----------------------------------------------------------------------
+# O texto é consumido página a página: cada bloco iniciado por "Código Emp." é
+# mantido aberto entre páginas e processado assim que o próximo marcador aparece,
+# de modo que o documento inteiro nunca precisa estar em memória como uma única
+# string e os primeiros registros ficam disponíveis antes da última página.
+#
+# Os registros vão direto para colunas tipadas (RecordColumns): competência como mês
+# ordinal, CNPJ codificado por dicionário e salário em float64. A análise recebe as
+# colunas prontas, sem converter competências de texto para data.
+#
+# Todos os padrões são compilados uma única vez, aqui. A comparação com a
+# implementação anterior (split do texto completo seguido de regex por bloco) fica em
+# benchmarks/bench_parser.py.
+# ----------------------------------------------------------------------
+BLOCK_MARKER   = "Código Emp."
+AGRUPAMENTO    = "AGRUPAMENTO DE CONTRATANTES/COOPERATIVAS"
+CNPJ_RE        = r"\d{2}\.\d{3}\.\d{3}(?:/\d{4}-\d{2})?"
+re_cnpj_bloco  = re.compile(CNPJ_RE)
+re_simples     = re.compile(r"^(\d{2}/\d{4})\s+([\d.,]+)$", re.MULTILINE)
+re_agrup       = re.compile(
+    rf"""
+      ^(\d{{2}}/\d{{4}})            # 1 - Competência
+      \s+({CNPJ_RE})                # 2 - CNPJ 1 (coluna Contrat.)
+      (?:\s+({CNPJ_RE}))?           # 3 - CNPJ 2 (opcional)
+      \s+.*?                        # lixo
+      \s+([\d.,]+)$                 # 4 - Valor
+    """,
+    re.MULTILINE | re.VERBOSE,
+)
+
+
+def add_diagnostic(diagnostics, level, message):
+    # Erros e avisos são acumulados como dados, e não exibidos diretamente,
+    # para que o mesmo código sirva ao app e ao processamento em lote.
+    diagnostics.append({"level": level, "message": message})
+
+
+def iter_cnis_blocks(page_texts):
+    # Equivalente a re.split(r"Código Emp\.", "".join(page_texts)), mas sem montar o texto completo.
+    # O marcador é procurado só no texto novo de cada página; os pedaços do bloco aberto
+    # ficam em uma lista e são unidos uma única vez, quando o bloco fecha.
+    parts = []
+    carry = ""
+    for text in page_texts:
+        text = carry + text
+        start = 0
+        found = text.find(BLOCK_MARKER)
+        while found >= 0:
+            parts.append(text[start:found])
+            yield "".join(parts)
+            parts = []
+            start = found + len(BLOCK_MARKER)
+            found = text.find(BLOCK_MARKER, start)
+        # Um marcador pode começar no fim desta página e terminar na seguinte
+        cut = max(start, len(text) - len(BLOCK_MARKER) + 1)
+        parts.append(text[start:cut])
+        carry = text[cut:]
+    parts.append(carry)
+    yield "".join(parts)
+
+
+class RecordColumns:
+    # Registros em colunas tipadas (array do módulo padrão: 16 bytes por registro, em
+    # vez de um dicionário com duas strings e um float):
+    #   competences  int32, mês ordinal (ano * 12 + mês - 1, como em cnis/inss.py);
+    #                -1 quando o mês é inválido (ex.: "13/2020")
+    #   cnpj_codes   int32, posição do CNPJ em `cnpjs` (codificação por dicionário)
+    #   salaries     float64
+    # As colunas podem ser vistas como arrays NumPy sem cópia (np.frombuffer).
+
+    def __init__(self):
+        self.competences = array("i")
+        self.cnpj_codes = array("i")
+        self.salaries = array("d")
+        self.cnpjs = []
+        self._cnpj_codes = {}
+
+    def __len__(self):
+        return len(self.salaries)
+
+    def cnpj_code(self, cnpj):
+        code = self._cnpj_codes.get(cnpj)
+        if code is None:
+            code = self._cnpj_codes[cnpj] = len(self.cnpjs)
+            self.cnpjs.append(cnpj)
+        return code
+
+    def extend(self, competences, cnpjs, salaries):
+        # Acrescenta registros já validados; `cnpjs` pode ser um único CNPJ para todos
+        self.competences.fromlist(list(map(_ORDINALS.__getitem__, competences)))
+        if isinstance(cnpjs, str):
+            self.cnpj_codes.extend(array("i", [self.cnpj_code(cnpjs)]) * len(competences))
+        else:
+            codes = {cnpj: self.cnpj_code(cnpj) for cnpj in dict.fromkeys(cnpjs)}
+            self.cnpj_codes.fromlist(list(map(codes.__getitem__, cnpjs)))
+        self.salaries.fromlist(salaries)
+
+    def rows(self):
+        # Registros como dicionários, no formato do parser anterior (comparações, depuração)
+        for ordinal, code, salary in zip(self.competences, self.cnpj_codes, self.salaries):
+            yield {"Competência": format_competence(ordinal) if ordinal >= 0 else None,
+                   "CNPJ": self.cnpjs[code], "Salário": salary}
+
+
+class _OrdinalCache(dict):
+    # "MM/AAAA" -> mês ordinal, calculado uma vez por competência distinta. O cache é
+    # do processo (as mesmas competências se repetem de um extrato para outro) e só
+    # guarda meses válidos, o que limita o seu tamanho a 12 entradas por ano.
+    def __missing__(self, competence):
+        month, year = int(competence[:2]), int(competence[3:])
+        if not 1 <= month <= 12:
+            return -1
+        ordinal = self[competence] = year * 12 + month - 1
+        return ordinal
+
+
+_ORDINALS = _OrdinalCache()
+
+
+def format_competence(ordinal):
+    # Mês ordinal -> "MM/AAAA"
+    return f"{ordinal % 12 + 1:02d}/{ordinal // 12}"
+
+
+def _parse_salaries(comps, vals, mode, diagnostics):
+    # Converte os valores do bloco de uma vez: o separador de milhar é removido e a
+    # vírgula decimal vira ponto em todos os valores juntos (nenhum contém quebra de
+    # linha). Quando float() recusa um valor, list.extend mantém os já convertidos e o
+    # iterador já passou do valor inválido: a conversão continua dali, e o registro é
+    # avisado e descartado, como antes. Devolve os salários e as posições descartadas.
+    salaries, bad = [], []
+    texts = iter("\n".join(vals).replace(".", "").replace(",", ".").split("\n"))
+    while True:
+        try:
+            salaries.extend(map(float, texts))
+            break
+        except ValueError:
+            i = len(salaries) + len(bad)
+            bad.append(i)
+            add_diagnostic(diagnostics, "warning", f"Não foi possível converter o salário '{vals[i]}' para número na competência {comps[i]} ({mode}). Ignorando registro.")
+    return salaries, bad
+
+
+def _without(values, positions):
+    # Cópia de `values` sem as posições indicadas (poucas, em ordem crescente)
+    values = list(values)
+    for i in reversed(positions):
+        del values[i]
+    return values
+
+
+def parse_cnis_block(bloco, diagnostics, records):
+    bloco = bloco.strip()
+
+    if AGRUPAMENTO in bloco:
+        matches = re_agrup.findall(bloco)
+        if matches:
+            comps, cnpjs, _, vals = zip(*matches)   # CNPJ 1 é o principal
+            salaries, bad = _parse_salaries(comps, vals, "agrupamento", diagnostics)
+            if bad:
+                comps, cnpjs = _without(comps, bad), _without(cnpjs, bad)
+            records.extend(comps, cnpjs, salaries)
+    else:
+        m = re_cnpj_bloco.search(bloco)
+        if not m:
+            return
+        matches = re_simples.findall(bloco)
+        if matches:
+            comps, vals = zip(*matches)
+            salaries, bad = _parse_salaries(comps, vals, "simples", diagnostics)
+            if bad:
+                comps = _without(comps, bad)
+            records.extend(comps, m.group(0), salaries)
+
+
+def parse_cnis_records(page_texts, diagnostics):
+    # Devolve um RecordColumns com os registros de todo o extrato, na ordem do texto
+    records = RecordColumns()
+    for bloco in iter_cnis_blocks(page_texts):
+        parse_cnis_block(bloco, diagnostics, records)
+    return records
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from cnis.analysis import window_bounds
+from cnis.diskfiles import iter_files, remove_file, write_file_atomic
+from cnis.inss import calculate_inss_batch, get_max_contribution_batch
+from cnis.parser import format_competence
+
+# ----------------------------------------------------------------------
+# REGISTROS PERSISTIDOS E REANÁLISE (Parquet, um arquivo por extrato)
+# ----------------------------------------------------------------------
+# As remunerações extraídas de cada PDF (competência, CNPJ, salário) são gravadas
+# em Parquet, com a mesma chave do armazenamento de PDFs (SHA-256 do conteúdo):
+#   competencia  int32, mês ordinal (ano * 12 + mês - 1), como em cnis/inss.py
+#   cnpj         string codificada por dicionário (poucos CNPJs por extrato)
+#   salario      float64
+# Um extrato de 30 anos ocupa poucos KiB. As contribuições e a contribuição a maior
+# não são gravadas: dependem das tabelas do INSS e são recalculadas a cada leitura.
+#
+# Sobre esses registros, sem reabrir PDF algum:
+#   reanalyze(...)  refaz a análise de um extrato para qualquer data de referência e
+#                   tamanho de janela, com o mesmo resultado de analyze_pdf_bytes;
+#   sweep(...)      calcula cenários (data de referência x janela) para milhares de
+#                   extratos de uma vez, em operações vetorizadas sobre todos os registros.
+#
+#   python -m cnis.batch extratos/ -o resultados.csv --records-dir registros/
+#   python -m cnis.records sweep registros/ --reference 2026-01-01 2024-01-01 --window 5 10 -o cenarios.csv
+#   python -m cnis.records info registros/
+#
+# Requer a biblioteca 'pyarrow' (importada só quando um arquivo é lido ou gravado).
+# ----------------------------------------------------------------------
+
+RECORDS_FORMAT_VERSION = 1
+METADATA_KEY = b"cnis.records"
+
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
+
+SWEEP_FIELDS = [
+    "documento",
+    "referencia",
+    "janela_anos",
+    "total_contribuicoes_a_maior",
+    "total_registros",
+    "total_competencias",
+    "periodo_inicio",
+    "periodo_fim",
+]
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Os registros persistidos requerem a biblioteca 'pyarrow' (pip install pyarrow).") from None
+    return pa, pq
+
+
+class RecordStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Gravação e leitura
+    # ------------------------------------------------------------------
+    def put(self, key, df, page_count=0):
+        # `df` é o DataFrame da análise após add_contributions: só entram os registros
+        # com competência válida, na ordem do extrato. As colunas já vêm tipadas do
+        # parser (mês ordinal, CNPJ categórico) e passam para o Arrow sem conversão.
+        pa, pq = _pyarrow()
+        cnpj = df["CNPJ"].array
+        table = pa.table({
+            "competencia": pa.array(df["Competência"].to_numpy(dtype=np.int32)),
+            "cnpj": pa.DictionaryArray.from_arrays(pa.array(cnpj.codes.astype(np.int32)),
+                                                   pa.array(list(cnpj.categories), pa.string())),
+            "salario": pa.array(df["Salário"].to_numpy(dtype=np.float64)),
+        })
+        metadata = {"version": RECORDS_FORMAT_VERSION, "page_count": int(page_count), "created_at": time.time()}
+        table = table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata).encode("utf-8")})
+
+        write_file_atomic(self._path(key), lambda tmp_path: pq.write_table(table, tmp_path, compression="zstd"))
+        return key
+
+    def read(self, key, columns=None):
+        # Devolve a tabela Arrow do extrato; KeyError se não houver registros gravados.
+        # ParquetFile.read, sem threads, custa uma fração de pq.read_table (que monta um
+        # dataset a cada chamada) quando se leem milhares de arquivos pequenos.
+        _, pq = _pyarrow()
+        try:
+            parquet_file = pq.ParquetFile(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key) from None
+        with parquet_file:
+            return parquet_file.read(columns=columns, use_threads=False)
+
+    def metadata(self, key):
+        table = self.read(key)
+        return json.loads(table.schema.metadata[METADATA_KEY])
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        return remove_file(self._path(key))
+
+    def keys(self):
+        for path, _, _ in iter_files(self.directory, ".parquet"):
+            key = os.path.basename(path)[:-len(".parquet")]
+            if _KEY_RE.fullmatch(key):
+                yield key
+
+    def _path(self, key):
+        if not isinstance(key, str) or not _KEY_RE.fullmatch(key):
+            raise ValueError(f"Chave de registros inválida: {key!r}")
+        return os.path.join(self.directory, key[:2], key + ".parquet")
+
+
+# ----------------------------------------------------------------------
+# Reanálise de um extrato
+# ----------------------------------------------------------------------
+def records_to_frame(table):
+    # DataFrame com as mesmas colunas que a análise produz até add_contributions
+    import pandas as pd
+    from cnis.analysis import RECORD_COLUMNS, add_contributions
+
+    cnpj = table.column("cnpj").combine_chunks()
+    df = pd.DataFrame({
+        "Competência": table.column("competencia").to_numpy(),
+        "CNPJ": pd.Categorical.from_codes(cnpj.indices.to_numpy(zero_copy_only=False).astype(np.int32),
+                                          categories=cnpj.dictionary.to_pylist()),
+        "Salário": table.column("salario").to_numpy(),
+    }, columns=RECORD_COLUMNS)
+    return add_contributions(df)
+
+
+def reanalyze(store, key, reference_date, window_years=5):
+    # Mesmo resultado de analyze_pdf_bytes(pdf, reference_date, window_years=...) para o
+    # PDF de chave `key`, com as tabelas do INSS atuais, a partir dos registros gravados.
+    import pandas as pd
+    from cnis.analysis import add_overpayments, summarize
+
+    table = store.read(key)
+    page_count = json.loads(table.schema.metadata[METADATA_KEY]).get("page_count", 0)
+    df = add_overpayments(records_to_frame(table))
+    return summarize(df, pd.Timestamp(reference_date), page_count, [], window_years)
+
+
+# ----------------------------------------------------------------------
+# Cenários sobre muitos extratos
+# ----------------------------------------------------------------------
+def load_records(store, keys=None):
+    # Concatena os registros dos extratos em arrays únicos; `documento` é a posição
+    # de cada registro em `keys`.
+    keys = list(store.keys()) if keys is None else list(keys)
+    ordinals, salaries, documents = [], [], []
+    for i, key in enumerate(keys):
+        table = store.read(key, columns=["competencia", "salario"])
+        ordinals.append(table.column("competencia").to_numpy())
+        salaries.append(table.column("salario").to_numpy())
+        documents.append(np.full(table.num_rows, i, dtype=np.int32))
+    if not keys:
+        return keys, np.zeros(0, np.int64), np.zeros(0), np.zeros(0, np.int32)
+    return keys, np.concatenate(ordinals).astype(np.int64), np.concatenate(salaries), np.concatenate(documents)
+
+
+def sweep(store, scenarios, keys=None):
+    # `scenarios`: pares (data de referência, anos da janela). Devolve um DataFrame com
+    # uma linha por extrato e cenário (colunas em SWEEP_FIELDS).
+    #
+    # Contribuições e contribuição a maior por competência não dependem do cenário:
+    # são calculadas uma única vez, para todos os registros, e reduzidas a grupos
+    # (extrato, competência). Cada cenário é só uma máscara da janela sobre os grupos
+    # e somas por extrato (bincount). A contribuição a maior de cada competência é a
+    # mesma de add_overpayments (mesma ordem de soma); como na análise, ela conta uma
+    # vez por registro da competência. O total por extrato é somado em outra ordem que
+    # a de Series.sum e pode diferir do da análise completa na última casa de precisão
+    # (muito abaixo de um centavo). O período é o intervalo cronológico das
+    # competências na janela, que termina no mês de referência (window_bounds): com
+    # referência 2020-01-01 e janela de 3 anos, só entram 01/2017 a 01/2020, mesmo que o
+    # extrato tenha competências posteriores.
+    import pandas as pd
+
+    keys, ordinals, salaries, documents = load_records(store, keys)
+    n_docs = len(keys)
+
+    contributions = calculate_inss_batch(salaries, ordinals)
+
+    # Grupos (extrato, competência), em ordem de extrato e competência
+    base = int(ordinals.min()) if len(ordinals) else 0
+    span = int(ordinals.max()) - base + 1 if len(ordinals) else 1
+    group_codes, group_of_row = np.unique(documents.astype(np.int64) * span + (ordinals - base), return_inverse=True)
+    group_doc = group_codes // span
+    group_ordinal = group_codes % span + base
+    group_records = np.bincount(group_of_row, minlength=len(group_codes))
+
+    group_total = np.bincount(group_of_row, weights=contributions, minlength=len(group_codes))
+    group_excess = np.maximum(group_total - get_max_contribution_batch(group_ordinal), 0.0)
+    group_excess_records = group_excess * group_records
+
+    labels = np.array([format_competence(base + i) for i in range(span)] + ["N/A"], dtype=object)
+
+    frames = []
+    for reference_date, window_years in scenarios:
+        reference = pd.Timestamp(reference_date)
+        start_cutoff, end_cutoff = window_bounds(reference, window_years)
+        groups = (group_ordinal >= start_cutoff) & (group_ordinal <= end_cutoff)
+        docs = group_doc[groups]
+
+        competences = np.bincount(docs, minlength=n_docs)
+        first = np.full(n_docs, span)
+        last = np.full(n_docs, -1)
+        np.minimum.at(first, docs, group_ordinal[groups] - base)
+        np.maximum.at(last, docs, group_ordinal[groups] - base)
+
+        frames.append(pd.DataFrame({
+            "documento": keys,
+            "referencia": reference.strftime("%Y-%m-%d"),
+            "janela_anos": window_years,
+            "total_contribuicoes_a_maior": np.bincount(docs, weights=group_excess_records[groups], minlength=n_docs),
+            "total_registros": np.bincount(docs, weights=group_records[groups], minlength=n_docs).astype(np.int64),
+            "total_competencias": competences,
+            "periodo_inicio": labels[first],
+            "periodo_fim": labels[np.where(competences > 0, last, span)],
+        }, columns=SWEEP_FIELDS))
+    if not frames:
+        return pd.DataFrame(columns=SWEEP_FIELDS)
+    return pd.concat(frames, ignore_index=True)
+
+
+# ----------------------------------------------------------------------
+# Linha de comando
+# ----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cnis.records", description="Reanálise dos registros CNIS persistidos.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    info = commands.add_parser("info", help="quantidade de extratos e registros gravados")
+    info.add_argument("directory", help="diretório dos registros")
+
+    scenarios = commands.add_parser("sweep", help="calcula cenários para todos os extratos gravados")
+    scenarios.add_argument("directory", help="diretório dos registros")
+    scenarios.add_argument("--reference", nargs="+", required=True, help="datas de referência (AAAA-MM-DD)")
+    scenarios.add_argument("--window", type=int, nargs="+", default=[5], help="tamanhos da janela, em anos (padrão: 5)")
+    scenarios.add_argument("-o", "--output", default=None, help="arquivo de saída (.csv ou .parquet; padrão: CSV na saída padrão)")
+    args = parser.parse_args(argv)
+
+    store = RecordStore(args.directory)
+    started = time.perf_counter()
+    if args.command == "info":
+        keys, ordinals, _, _ = load_records(store)
+        print(f"{len(keys)} extratos, {len(ordinals)} registros", file=sys.stderr)
+        return 0
+
+    result = sweep(store, [(reference, window) for reference in args.reference for window in args.window])
+    elapsed = time.perf_counter() - started
+    if args.output and args.output.lower().endswith(".parquet"):
+        result.to_parquet(args.output, index=False)
+    else:
+        result.to_csv(args.output or sys.stdout, index=False)
+    print(f"{len(result)} linhas ({result['documento'].nunique()} extratos) em {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import math
+import threading
+import time
+from collections import deque
+
+from cnis.extract import EXTRACT_WORKERS, PARALLEL_MIN_PAGES
+from cnis.parser import add_diagnostic
+
+# ----------------------------------------------------------------------
+# CONTROLE DE ADMISSÃO DAS ANÁLISES (fila única do processo)
+# ----------------------------------------------------------------------
+# Cada sessão do Streamlit roda o script na sua própria thread; sem controle, uma
+# rajada de uploads dispara tantas análises simultâneas quanto sessões, e todas
+# ficam lentas disputando CPU e memória. AnalysisScheduler é criado uma vez por
+# processo (st.cache_resource em app.py) e:
+#   - recusa de imediato PDFs acima de max_bytes ou de max_pages páginas, antes de
+#     entrarem na fila;
+#   - executa no máximo max_concurrent análises ao mesmo tempo (threads próprias; cada
+#     análise roda em um processo do pool de cnis/extract.py, ver analyze_in_pool);
+#   - um extrato longo (PARALLEL_MIN_PAGES páginas ou mais) que começa sem fila e com
+#     outras vagas ociosas é analisado na própria thread, com a extração das páginas
+#     repartida pelo pool (cnis/extract.py), em vez de ficar inteiro em um só processo;
+#   - enfileira as demais até max_queue e, com a fila cheia, recusa novas análises
+#     com um aviso para tentar mais tarde, em vez de degradar todas as outras;
+#   - informa a posição na fila e uma estimativa de espera, a partir da média móvel
+#     da duração das últimas análises;
+#   - dá a cada análise job_timeout segundos, contados do início da execução (prazo
+#     conferido entre as páginas, ver analyze_pdf_bytes).
+# O mesmo extrato enviado por duas sessões ao mesmo tempo (mesma chave) é analisado
+# uma única vez: a segunda recebe o mesmo ticket.
+#
+# Recusas, prazo vencido e erros inesperados viram resultados de falha com o aviso
+# em "diagnostics", como os demais erros da análise.
+#
+# Configuração do app por variáveis de ambiente (lidas em app.py):
+#   CNIS_MAX_CONCURRENT     análises simultâneas (padrão: CNIS_EXTRACT_WORKERS)
+#   CNIS_MAX_QUEUE          análises aguardando na fila (padrão: 32)
+#   CNIS_MAX_PDF_BYTES      tamanho máximo do PDF (padrão: 20 MiB)
+#   CNIS_MAX_PDF_PAGES      páginas por PDF (padrão: 2000)
+#   CNIS_ANALYSIS_TIMEOUT   prazo de cada análise, em segundos (padrão: 120)
+# ----------------------------------------------------------------------
+
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_MAX_PAGES = 2000
+DEFAULT_JOB_TIMEOUT = 120.0
+
+# Peso da última análise na média móvel da duração
+DURATION_SMOOTHING = 0.2
+
+
+def run_analysis(pdf_bytes, parallel=False, **job):
+    # Executor padrão: análise completa em um processo do pool ou, com `parallel`, nesta
+    # thread com a extração em paralelo no pool. Nesse caso o prazo é conferido entre
+    # as páginas, como em analyze_pdf_bytes. (Imports sob demanda, para que importar
+    # este módulo não carregue NumPy nem pandas.)
+    from cnis.analysis import analyze_in_pool, analyze_pdf_bytes
+    if parallel:
+        return analyze_pdf_bytes(pdf_bytes, **job)
+    return analyze_in_pool(pdf_bytes, **job)
+
+
+def _failure(level, message):
+    diagnostics = []
+    add_diagnostic(diagnostics, level, message)
+    return {"success": False, "total_paginas": 0, "diagnostics": diagnostics}
+
+
+def _count_pages(pdf_bytes):
+    # Contar as páginas só lê a tabela de referências do PDF; um arquivo que não abre
+    # (None) segue para a análise, que informa o erro como de costume.
+    import fitz
+    try:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    except Exception:
+        return None
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+class AnalysisTicket:
+    # Uma análise pedida ao AnalysisScheduler: aguarda-se o resultado com wait/result,
+    # e position/eta informam a espera enquanto ela não começa.
+
+    def __init__(self, scheduler, key, pdf_bytes, job, pages=None):
+        self.key = key
+        self.pages = pages         # páginas do PDF, se conhecidas
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.queue_full = False    # recusado só porque a fila estava cheia (vale tentar de novo)
+        self._scheduler = scheduler
+        self._pdf_bytes = pdf_bytes
+        self._job = job
+        self._subscribers = 1
+        self._done = threading.Event()
+        self._result = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        self._done.wait(timeout)
+        return self._result
+
+    def position(self):
+        # 1 para a próxima análise a começar; 0 se já começou ou terminou
+        return self._scheduler.position(self)
+
+    def eta(self):
+        # Segundos estimados até o resultado, ou None sem histórico de análises
+        return self._scheduler.eta(self)
+
+    def cancel(self):
+        return self._scheduler.cancel(self)
+
+    def _finish(self, result):
+        self._pdf_bytes = self._job = None   # libera os bytes do PDF
+        self._result = result
+        self._done.set()
+
+
+class AnalysisScheduler:
+    def __init__(self, max_concurrent=None, max_queue=DEFAULT_MAX_QUEUE, max_bytes=DEFAULT_MAX_BYTES,
+                 max_pages=DEFAULT_MAX_PAGES, job_timeout=DEFAULT_JOB_TIMEOUT, run=run_analysis):
+        self.max_concurrent = max(1, max_concurrent or EXTRACT_WORKERS)
+        self.max_queue = max_queue
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.job_timeout = job_timeout
+        self._run = run
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._jobs = {}            # chave -> ticket, na fila ou em execução
+        self._running = set()
+        self._threads = []
+        self._duration = None      # média móvel da duração das análises, em segundos
+        self._counters = {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0,
+                          "rejected": 0, "timeouts": 0, "cancelled": 0}
+
+    # ------------------------------------------------------------------
+    # Pedidos
+    # ------------------------------------------------------------------
+    def start(self):
+        with self._cond:
+            while len(self._threads) < self.max_concurrent:
+                thread = threading.Thread(target=self._work, name=f"cnis-analysis-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit(self, key, pdf_bytes, **job):
+        # `job`: argumentos de analyze_pdf_bytes (today, window_years, record_store,
+        # record_key). Devolve sempre um ticket; se o pedido for recusado, ele já vem
+        # concluído com o aviso.
+        pages = None
+        rejection = self._check_bytes(pdf_bytes)
+        if rejection is None:
+            pages = _count_pages(pdf_bytes)
+            rejection = self._check_pages(pages)
+        if rejection is not None:
+            return self._rejected(key, rejection)
+
+        with self._cond:
+            ticket = self._jobs.get(key)
+            if ticket is not None:
+                ticket._subscribers += 1
+                self._counters["coalesced"] += 1
+                return ticket
+            # Pedidos ainda não retirados da fila por workers ociosos não contam no
+            # limite da fila: começam assim que as threads acordarem
+            idle = self.max_concurrent - len(self._running)
+            if len(self._queue) < self.max_queue + idle:
+                ticket = self._jobs[key] = AnalysisTicket(self, key, pdf_bytes, job, pages)
+                self._queue.append(ticket)
+                self._counters["submitted"] += 1
+                self._cond.notify()
+                return ticket
+        return self._rejected(key, "Muitas análises em andamento no momento. Por favor, tente novamente em alguns minutos.",
+                              queue_full=True)
+
+    def _check_bytes(self, pdf_bytes):
+        size = len(pdf_bytes)
+        if self.max_bytes and size > self.max_bytes:
+            return (f"O arquivo tem {size / 2**20:.1f} MB, acima do limite de {self.max_bytes / 2**20:.0f} MB. "
+                    "Envie apenas o extrato CNIS.")
+        return None
+
+    def _check_pages(self, pages):
+        if self.max_pages and pages is not None and pages > self.max_pages:
+            return f"O arquivo tem {pages} páginas, acima do limite de {self.max_pages}. Envie apenas o extrato CNIS."
+        return None
+
+    def _rejected(self, key, message, queue_full=False):
+        ticket = AnalysisTicket(self, key, None, None)
+        ticket.queue_full = queue_full
+        with self._cond:
+            self._counters["rejected"] += 1
+        ticket._finish(_failure("error", message))
+        return ticket
+
+    def cancel(self, ticket):
+        # Desiste de um pedido que ainda não começou (ex.: a sessão trocou de arquivo).
+        # Com outras sessões aguardando o mesmo extrato, ele continua na fila.
+        with self._cond:
+            if ticket.done() or ticket not in self._queue:
+                return False
+            ticket._subscribers -= 1
+            if ticket._subscribers > 0:
+                return False
+            self._queue.remove(ticket)
+            del self._jobs[ticket.key]
+            self._counters["cancelled"] += 1
+        ticket._finish(_failure("warning", "Análise cancelada."))
+        return True
+
+    # ------------------------------------------------------------------
+    # Espera
+    # ------------------------------------------------------------------
+    def position(self, ticket):
+        with self._cond:
+            try:
+                return self._queue.index(ticket) + 1
+            except ValueError:
+                return 0
+
+    def eta(self, ticket):
+        with self._cond:
+            if ticket.done():
+                return 0.0
+            if self._duration is None:
+                return None
+            if ticket.started_at is not None:
+                return max(self._duration - (time.monotonic() - ticket.started_at), 0.0)
+            try:
+                ahead = self._queue.index(ticket)
+            except ValueError:
+                return self._duration
+            # Rodadas de max_concurrent análises antes desta, mais a própria
+            return (math.floor(ahead / self.max_concurrent) + 1) * self._duration
+
+    # ------------------------------------------------------------------
+    # Execução
+    # ------------------------------------------------------------------
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                ticket = self._queue.popleft()
+                ticket.started_at = time.monotonic()
+                self._running.add(ticket)
+                # Sem fila e com vagas ociosas, os núcleos do pool estariam parados
+                parallel = (ticket.pages is not None and ticket.pages >= PARALLEL_MIN_PAGES
+                            and not self._queue and len(self._running) < self.max_concurrent)
+
+            try:
+                result = self._run(ticket._pdf_bytes, timeout=self.job_timeout, parallel=parallel, **ticket._job)
+            except Exception as e:
+                # Falha fora da análise (ex.: processo do pool encerrado pelo sistema)
+                result = _failure("error", f"Erro ao analisar o extrato: {type(e).__name__}: {e}")
+
+            elapsed = time.monotonic() - ticket.started_at
+            with self._cond:
+                self._running.discard(ticket)
+                self._jobs.pop(ticket.key, None)
+                self._duration = elapsed if self._duration is None else (
+                    (1 - DURATION_SMOOTHING) * self._duration + DURATION_SMOOTHING * elapsed)
+                self._counters["completed" if result["success"] else "failed"] += 1
+                if not result["success"] and self.job_timeout and elapsed >= self.job_timeout:
+                    self._counters["timeouts"] += 1
+            ticket._finish(result)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "running": len(self._running),
+                "queued": len(self._queue),
+                "avg_seconds": None if self._duration is None else round(self._duration, 3),
+                **self._counters,
+            }
+
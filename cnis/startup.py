@@ -0,0 +1,128 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# ----------------------------------------------------------------------
+# MEDIÇÃO DO CUSTO DE INICIALIZAÇÃO
+# ----------------------------------------------------------------------
+# Importa cada parte do pacote em um interpretador novo (sem cache de módulos já
+# carregados) e informa o tempo de importação e quais dependências pesadas cada
+# uma puxou. Workers do Streamlit e do lote pagam esse custo a cada cold start.
+#
+#   python -m cnis.startup            relatório em tabela
+#   python -m cnis.startup --json     relatório em JSON
+#   python -m cnis.startup --check    falha (código 1) se alguma parte leve puxar
+#                                     pandas, PyMuPDF ou Streamlit, ou estourar o orçamento
+# ----------------------------------------------------------------------
+
+HEAVY_MODULES = ("numpy", "pandas", "fitz", "pymupdf", "streamlit", "pyarrow")
+
+# Módulo -> dependências pesadas permitidas na importação (o restante deve ser sob demanda)
+PARTS = {
+    "cnis": (),
+    "cnis.diskfiles": (),
+    "cnis.cache": (),
+    "cnis.parser": (),
+    "cnis.extract": (),
+    "cnis.metrics": (),
+    "cnis.storage": (),
+    "cnis.outbox": (),
+    "cnis.scheduler": (),
+    "cnis.export": (),
+    "cnis.inss": ("numpy",),
+    "cnis.analysis": ("numpy",),
+    "cnis.records": ("numpy",),
+    "cnis.batch": (),
+}
+
+# Referência: custo das dependências pesadas isoladamente
+DEPENDENCIES = ("numpy", "pandas", "fitz", "streamlit")
+
+DEFAULT_BUDGET_MS = 250.0
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def measure_import(module, python=sys.executable):
+    # Importa o módulo em um processo novo; o tempo inclui tudo que ele importa transitivamente.
+    probe = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    completed = subprocess.run([python, "-c", probe], capture_output=True, text=True)
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "erro desconhecido"
+        return {"module": module, "seconds": None, "heavy": [], "error": error}
+    data = json.loads(completed.stdout.strip().splitlines()[-1])
+    data["module"] = module
+    return data
+
+
+def run_check(budget_ms=DEFAULT_BUDGET_MS, repeat=3):
+    report = {"parts": [], "dependencies": [], "violations": []}
+    for module, allowed in PARTS.items():
+        # Menor tempo entre as repetições: reduz o ruído do cache de disco e do sistema
+        samples = [measure_import(module) for _ in range(repeat)]
+        best = min(samples, key=lambda s: s["seconds"] if s["seconds"] is not None else float("inf"))
+        report["parts"].append(best)
+
+        if best["seconds"] is None:
+            report["violations"].append(f"{module}: falha ao importar ({best['error']})")
+            continue
+        unexpected = [name for name in best["heavy"] if name not in allowed]
+        if unexpected:
+            report["violations"].append(f"{module}: importa {', '.join(unexpected)} na inicialização")
+        if best["seconds"] * 1000 > budget_ms:
+            report["violations"].append(f"{module}: {best['seconds'] * 1000:.0f} ms excede o orçamento de {budget_ms:.0f} ms")
+
+    for module in DEPENDENCIES:
+        samples = [measure_import(module) for _ in range(repeat)]
+        report["dependencies"].append(min(samples, key=lambda s: s["seconds"] if s["seconds"] is not None else float("inf")))
+    return report
+
+
+def _format_row(entry):
+    if entry["seconds"] is None:
+        return f"  {entry['module']:<16} {'—':>9}   erro: {entry['error']}"
+    heavy = ", ".join(entry["heavy"]) or "-"
+    return f"  {entry['module']:<16} {entry['seconds'] * 1000:>7.1f} ms   pesados: {heavy}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cnis.startup", description="Mede o custo de importação do pacote cnis.")
+    parser.add_argument("--json", action="store_true", help="emite o relatório em JSON")
+    parser.add_argument("--check", action="store_true", help="retorna código 1 se houver violações")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="orçamento por parte do pacote, em ms")
+    parser.add_argument("--repeat", type=int, default=3, help="repetições por módulo (usa a menor)")
+    args = parser.parse_args(argv)
+
+    report = run_check(args.budget_ms, args.repeat)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print("Partes do pacote:")
+        for entry in report["parts"]:
+            print(_format_row(entry))
+        print("Dependências (referência):")
+        for entry in report["dependencies"]:
+            print(_format_row(entry))
+        if report["violations"]:
+            print("Violações:")
+            for violation in report["violations"]:
+                print(f"  - {violation}")
+        else:
+            print("Nenhuma violação.")
+
+    if args.check and report["violations"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import hashlib
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from cnis.diskfiles import evict_files, iter_files, remove_file, write_bytes_atomic
+
+# ----------------------------------------------------------------------
+# ARMAZENAMENTO DOS PDFs ENVIADOS (em disco, endereçado por conteúdo)
+# ----------------------------------------------------------------------
+# O PDF que precisa ser guardado para o lead (envio posterior ao CRM, anexos) vai
+# para um diretório em disco, com o SHA-256 do conteúdo como chave: o mesmo extrato
+# enviado várias vezes, por uma ou várias sessões, ocupa um único arquivo. A sessão
+# guarda apenas a chave (64 caracteres), e a memória por sessão deixa de crescer
+# com o tamanho do PDF.
+#
+# A leitura é feita por mmap (UploadStore.open): o conteúdo é paginado pelo sistema
+# operacional sob demanda, sem cópia para a memória do Python, e pode ser passado
+# diretamente ao PyMuPDF (fitz.open(stream=...)).
+#
+# Os arquivos expiram por idade (ttl_seconds desde o último envio) e, acima de
+# max_bytes no total, os mais antigos são removidos primeiro.
+# ----------------------------------------------------------------------
+
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def content_digest(data):
+    # Aceita bytes ou qualquer objeto com protocolo de buffer (memoryview, mmap), sem copiá-lo
+    return hashlib.sha256(data).hexdigest()
+
+
+class UploadStore:
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._counters = {"puts": 0, "deduplicated": 0, "reads": 0, "evictions": 0}
+        os.makedirs(self.directory, exist_ok=True)
+        self._bytes = sum(size for _, _, size in iter_files(self.directory, ".pdf"))
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def put(self, data, digest=None):
+        # Grava o conteúdo (se ainda não existir) e devolve a chave. `digest` evita
+        # recalcular o hash quando o chamador já o tem.
+        key = digest or content_digest(data)
+        path = self._path(key)
+
+        with self._lock:
+            self._counters["puts"] += 1
+        try:
+            # Já armazenado: só renova a idade do arquivo
+            os.utime(path)
+            with self._lock:
+                self._counters["deduplicated"] += 1
+            return key
+        except FileNotFoundError:
+            pass
+
+        previous = write_bytes_atomic(path, data)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - previous
+            over_limit = self._bytes > self.max_bytes
+        if over_limit:
+            # Nunca remove o arquivo recém-gravado: a chave devolvida precisa ser legível
+            self.evict(keep=path)
+        return key
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            return None
+
+    @contextmanager
+    def open(self, key):
+        # Conteúdo somente leitura, mapeado em memória. A memoryview (e qualquer objeto
+        # que a referencie, como um documento do fitz) não deve sobreviver ao bloco with.
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise KeyError(key) from None
+        with f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                with self._lock:
+                    self._counters["reads"] += 1
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def read(self, key):
+        # Cópia do conteúdo em bytes, para quem precisa manter os dados após o uso
+        # (por exemplo, codificar um anexo). Prefira open() quando bastar o buffer.
+        with self.open(key) as view:
+            return view.tobytes()
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        return self._remove(path, size)
+
+    def evict(self, keep=None):
+        # Remove os arquivos expirados e, se o total ainda exceder max_bytes, os mais antigos
+        total, removed = evict_files(self.directory, ".pdf", self.max_bytes, self.ttl_seconds, keep=keep)
+        with self._lock:
+            self._bytes = total
+            self._counters["evictions"] += removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["bytes"] = self._bytes
+        return stats
+
+    # ------------------------------------------------------------------
+    # Arquivos
+    # ------------------------------------------------------------------
+    def _path(self, key):
+        # A chave vem da sessão: só aceita um SHA-256 em hexadecimal, para que nunca
+        # aponte para fora do diretório.
+        if not isinstance(key, str) or not _KEY_RE.fullmatch(key):
+            raise ValueError(f"Chave de armazenamento inválida: {key!r}")
+        return os.path.join(self.directory, key[:2], key + ".pdf")
+
+    def _remove(self, path, size=None):
+        if not remove_file(path):
+            return False
+        if size is not None:
+            with self._lock:
+                self._bytes -= size
+        return True